@@ -1,15 +1,44 @@
 # The COPYRIGHT file at the top level of this repository contains the full
 # copyright notices and license terms.
+from trytond.model import ModelStorage
 from trytond.pool import Pool
 from . import mass_editing
+from . import compute
+from . import csv_update
+from . import execution
+from . import job
+from . import preset
+from . import undo
+from . import validation
 
 
 def register():
     Pool.register(
         mass_editing.MassEdit,
         mass_editing.MassEditFields,
+        mass_editing.MassEditSQLFields,
+        mass_editing.MassEditCheckpoint,
+        mass_editing.MassEditWizardPick,
         mass_editing.MassEditWizardStart,
+        mass_editing.MassEditWizardPreview,
+        mass_editing.MassEditWizardPreset,
+        mass_editing.MassEditWizardDone,
+        job.MassEditJob,
+        job.MassEditJobCancellation,
+        execution.MassEditExecution,
+        undo.MassEditUndo,
+        undo.MassEditUndoLine,
+        csv_update.MassEditCSVStart,
+        csv_update.MassEditCSVDone,
+        preset.MassEditPreset,
+        preset.Cron,
+        validation.Trigger,
         module='mass_editing', type_='model')
     Pool.register(
         mass_editing.MassEditingWizard,
+        csv_update.MassEditCSV,
         module='mass_editing', type_='wizard')
+    Pool.register_mixin(compute.ComputeFieldsMixin, ModelStorage,
+        module='mass_editing')
+    Pool.register_mixin(validation.ValidateMixin, ModelStorage,
+        module='mass_editing')
@@ -0,0 +1,100 @@
+# The COPYRIGHT file at the top level of this repository contains the full
+# copyright notices and license terms.
+import threading
+from contextlib import contextmanager
+
+from trytond.model import ModelStorage, fields
+from trytond.tools import grouped_slice
+from trytond.transaction import Transaction, record_cache_size
+from trytond.transaction import without_check_access
+
+from .undo import dumps
+
+_local = threading.local()
+# Field types of the computed values compared to the stored ones
+_COMPARABLE_TYPES = {
+    'boolean', 'char', 'date', 'datetime', 'float', 'integer', 'numeric',
+    'selection', 'text', 'time', 'timestamp',
+    }
+
+
+class Deferred(object):
+    "The records of a model whose stored fields are waiting to be computed"
+
+    def __init__(self, Model):
+        self.model = Model.__name__
+        self.ids = set()
+        self.field_names = set()
+
+    def add(self, records, field_names=None):
+        self.ids.update(map(int, records))
+        if field_names is None or self.field_names is None:
+            self.field_names = None
+        else:
+            self.field_names.update(field_names)
+
+
+@contextmanager
+def deferred_compute(Model):
+    '''
+    Collect the records of Model written in the block instead of computing
+    their stored fields after each write.
+    '''
+    previous = getattr(_local, 'deferred', None)
+    _local.deferred = deferred = Deferred(Model)
+    try:
+        yield deferred
+    finally:
+        _local.deferred = previous
+
+
+class ComputeFieldsMixin(object):
+    __slots__ = ()
+
+    @classmethod
+    def _compute_fields(cls, records, field_names=None):
+        deferred = getattr(_local, 'deferred', None)
+        if deferred is not None and deferred.model == cls.__name__:
+            deferred.add(records, field_names)
+        else:
+            super()._compute_fields(records, field_names=field_names)
+
+    @classmethod
+    def has_compute_fields(cls):
+        "Return if the model computes stored fields on write"
+        return cls.compute_fields is not ModelStorage.compute_fields
+
+    @classmethod
+    @without_check_access
+    def mass_edit_compute_fields(cls, records, field_names=None):
+        '''
+        Compute the stored fields of the records and write together the
+        records sharing the same values.
+
+        The values already stored are not written.
+        '''
+        if not cls.has_compute_fields():
+            return
+        if field_names is not None:
+            field_names = set(field_names)
+        groups = {}
+        for sub_ids in grouped_slice(
+                list(map(int, records)),
+                record_cache_size(Transaction())):
+            for record in cls.browse(sub_ids):
+                values = record.compute_fields(field_names)
+                for name, value in list(values.items()):
+                    field = cls._fields.get(name)
+                    if (field is not None
+                            and field._type in _COMPARABLE_TYPES
+                            and not isinstance(field, fields.Function)
+                            and getattr(record, name) == value):
+                        del values[name]
+                if values:
+                    groups.setdefault(dumps(values), (values, []))[1].append(
+                        record)
+        to_write = []
+        for values, group in groups.values():
+            to_write.extend([group, values])
+        if to_write:
+            cls.write(*to_write)
@@ -0,0 +1,101 @@
+# The COPYRIGHT file at the top level of this repository contains the full
+# copyright notices and license terms.
+import io
+
+from trytond.transaction import Transaction
+from trytond.pool import Pool
+from trytond.model import ModelView, fields
+from trytond.pyson import Eval
+from trytond.wizard import Wizard, StateView, StateTransition, Button
+
+
+class MassEditCSVStart(ModelView):
+    'Mass Edit CSV Start'
+    __name__ = 'mass.editing.csv.start'
+    data = fields.Binary('File', required=True,
+        help='A CSV file encoded in UTF-8 whose first line holds the key '
+        'column and the names of the fields to update.')
+    key = fields.Char('Key', required=True,
+        help='The column identifying the records: "id" or the name of a '
+        'unique field.')
+    delimiter = fields.Char('Delimiter', required=True, size=1)
+    skip_unchanged = fields.Boolean('Skip Unchanged',
+        help='Do not write the records which already hold the values.')
+
+    @staticmethod
+    def default_key():
+        return 'id'
+
+    @staticmethod
+    def default_delimiter():
+        return ','
+
+    @staticmethod
+    def default_skip_unchanged():
+        return True
+
+
+class MassEditCSVDone(ModelView):
+    'Mass Edit CSV Done'
+    __name__ = 'mass.editing.csv.done'
+    processed = fields.Integer('Lines Processed', readonly=True)
+    written = fields.Integer('Records Updated', readonly=True)
+    skipped = fields.Integer('Records Skipped', readonly=True,
+        help='The records which already held the values.')
+    unmatched = fields.Integer('Keys Not Found', readonly=True)
+    unmatched_keys = fields.Text('Unmatched Keys', readonly=True,
+        states={
+            'invisible': ~Eval('unmatched_keys'),
+            })
+    duplicates = fields.Integer('Duplicate Keys', readonly=True,
+        help='The lines not applied because their key was already on a '
+        'previous line of the file: the first line of a key wins.')
+    duplicate_lines = fields.Text('Duplicate Lines', readonly=True,
+        states={
+            'invisible': ~Eval('duplicate_lines'),
+            })
+    failed = fields.Text('Records Not Updated', readonly=True,
+        states={
+            'invisible': ~Eval('failed'),
+            },
+        help='The ids of the records locked by other users.')
+
+
+class MassEditCSV(Wizard):
+    'Mass Edit CSV'
+    __name__ = 'mass.editing.csv'
+    start = StateView('mass.editing.csv.start',
+        'mass_editing.mass_editing_csv_start_view_form', [
+            Button('Cancel', 'end', 'tryton-cancel'),
+            Button('Update', 'update', 'tryton-ok', True),
+            ])
+    update = StateTransition()
+    done = StateView('mass.editing.csv.done',
+        'mass_editing.mass_editing_csv_done_view_form', [
+            Button('Close', 'end', 'tryton-close', True),
+            ])
+
+    def transition_update(self):
+        pool = Pool()
+        MassEdit = pool.get('mass.editing')
+        edit = MassEdit(Transaction().context['active_id'])
+        lines = io.TextIOWrapper(io.BytesIO(self.start.data),
+            encoding='utf-8-sig', newline='')
+        self.result = edit.execute_csv(lines, key=self.start.key,
+            delimiter=self.start.delimiter,
+            skip_unchanged=self.start.skip_unchanged)
+        return 'done'
+
+    def default_done(self, fields):
+        return {
+            'processed': self.result['processed'],
+            'written': self.result['written'],
+            'skipped': self.result['skipped'],
+            'unmatched': self.result['unmatched'],
+            'unmatched_keys': '\n'.join(
+                map(str, self.result['unmatched_keys'])),
+            'duplicates': self.result['duplicates'],
+            'duplicate_lines': ', '.join(
+                map(str, self.result['duplicate_lines'])),
+            'failed': ', '.join(map(str, self.result['failed'])),
+            }
@@ -0,0 +1,200 @@
+# The COPYRIGHT file at the top level of this repository contains the full
+# copyright notices and license terms.
+import cProfile
+import datetime
+import io
+import json
+import logging
+import pstats
+import threading
+import time
+from contextlib import nullcontext
+
+from trytond import backend
+from trytond.config import config
+from trytond.transaction import without_check_access
+from trytond.model import ModelView, ModelSQL, fields
+
+logger = logging.getLogger(__name__)
+_local = threading.local()
+
+
+class QueryCounter(logging.Handler):
+    "Count the queries logged by the database backend for the thread"
+
+    def __init__(self):
+        super(QueryCounter, self).__init__(logging.DEBUG)
+        self.thread = threading.get_ident()
+        self.count = 0
+
+    def emit(self, record):
+        if record.thread == self.thread:
+            self.count += 1
+
+
+class Metrics(object):
+    '''
+    The wall time, number of queries and records of the phases of a run.
+
+    The time and queries of a phase exclude those of the phases nested in it.
+    The queries are only counted when the database backend logs them, that is
+    when its logger is enabled for debug.
+    When the profile option of the mass_editing section of the configuration
+    is set, the run is also profiled and the statistics are logged.
+    '''
+
+    def __init__(self, name):
+        self.name = name
+        self.phases = {}
+        self.duration = None
+        self._stack = []
+        self._counter = None
+        self._profiler = None
+
+    def __enter__(self):
+        self._logger = logging.getLogger(
+            'trytond.backend.%s.database' % backend.name)
+        if self._logger.isEnabledFor(logging.DEBUG):
+            self._counter = QueryCounter()
+            self._logger.addHandler(self._counter)
+        if config.getboolean('mass_editing', 'profile', default=False):
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+        self._previous = getattr(_local, 'metrics', None)
+        _local.metrics = self
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.duration = time.perf_counter() - self._start
+        _local.metrics = self._previous
+        if self._profiler:
+            self._profiler.disable()
+            stream = io.StringIO()
+            stats = pstats.Stats(self._profiler, stream=stream)
+            stats.sort_stats('cumulative').print_stats(30)
+            logger.info('profile of %s\n%s', self.name, stream.getvalue())
+        if self._counter:
+            self._logger.removeHandler(self._counter)
+
+    @property
+    def queries(self):
+        if self._counter:
+            return self._counter.count
+
+    def phase(self, name, records=0):
+        return _Phase(self, name, records)
+
+    def as_dict(self, **values):
+        values.update({
+                'name': self.name,
+                'duration': self.duration,
+                'queries': self.queries,
+                'phases': self.phases,
+                })
+        return values
+
+    def log(self, level=logging.INFO, **values):
+        "Log the metrics with the values as a JSON object"
+        logger.log(level, '%s: %s', self.name, json.dumps(
+                self.as_dict(**values), sort_keys=True, default=str))
+
+
+class _Phase(object):
+
+    def __init__(self, metrics, name, records):
+        self.metrics = metrics
+        self.name = name
+        self.records = records
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        self.queries = self.metrics.queries or 0
+        # The time and queries of the nested phases
+        self.metrics._stack.append([0, 0])
+        return self
+
+    def __exit__(self, type, value, traceback):
+        metrics = self.metrics
+        elapsed = time.perf_counter() - self.start
+        queries = (metrics.queries or 0) - self.queries
+        nested_time, nested_queries = metrics._stack.pop()
+        if metrics._stack:
+            metrics._stack[-1][0] += elapsed
+            metrics._stack[-1][1] += queries
+        phase = metrics.phases.setdefault(self.name, {
+                'time': 0,
+                'calls': 0,
+                'records': 0,
+                'queries': 0,
+                })
+        phase['time'] += elapsed - nested_time
+        phase['calls'] += 1
+        phase['records'] += self.records
+        phase['queries'] += queries - nested_queries
+
+
+def phase(name, records=0):
+    "Return a context manager which measures a phase of the running metrics"
+    metrics = getattr(_local, 'metrics', None)
+    if metrics is None:
+        return nullcontext()
+    return metrics.phase(name, records)
+
+
+class MassEditExecution(ModelSQL, ModelView):
+    'Mass Edit Execution'
+    __name__ = 'mass.editing.execution'
+    mass_edit = fields.Many2One('mass.editing', 'Mass Edit', required=True,
+        readonly=True, ondelete='CASCADE')
+    job = fields.Many2One('mass.editing.job', 'Job', readonly=True,
+        ondelete='SET NULL')
+    processed = fields.Integer('Processed', readonly=True)
+    written = fields.Integer('Written', readonly=True)
+    skipped = fields.Integer('Skipped', readonly=True)
+    duration = fields.TimeDelta('Duration', readonly=True)
+    queries = fields.Integer('Queries', readonly=True,
+        help='Only counted when the SQL queries are logged.')
+    phases = fields.Dict(None, 'Phases', readonly=True)
+    summary = fields.Function(fields.Text('Summary'), 'get_summary')
+
+    @classmethod
+    def __setup__(cls):
+        super(MassEditExecution, cls).__setup__()
+        cls._order.insert(0, ('create_date', 'DESC'))
+        cls._order.insert(1, ('id', 'DESC'))
+
+    def get_rec_name(self, name):
+        return '%s (%s)' % (self.mass_edit.rec_name, self.id)
+
+    def get_summary(self, name):
+        lines = []
+        for key, phase in sorted((self.phases or {}).items(),
+                key=lambda i: i[1]['time'], reverse=True):
+            line = '%s: %.3fs, %s calls, %s records' % (
+                key, phase['time'], phase['calls'], phase['records'])
+            if self.queries is not None:
+                line += ', %s queries' % phase['queries']
+            lines.append(line)
+        return '\n'.join(lines)
+
+    @classmethod
+    @without_check_access
+    def register(cls, edit, metrics, result, job=None):
+        "Store the metrics of the execution of edit with its result"
+        metrics.log(mass_edit=edit.id, model=edit.model.name,
+            job=job.id if job else None, processed=result['processed'],
+            written=result['written'], skipped=result['skipped'],
+            failed=len(result['failed']))
+        execution = cls(
+            mass_edit=edit,
+            job=job,
+            processed=result['processed'],
+            written=result['written'],
+            skipped=result['skipped'],
+            duration=datetime.timedelta(seconds=metrics.duration),
+            queries=metrics.queries,
+            phases=metrics.phases,
+            )
+        execution.save()
+        return execution
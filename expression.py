@@ -0,0 +1,201 @@
+# The COPYRIGHT file at the top level of this repository contains the full
+# copyright notices and license terms.
+import ast
+import operator
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+
+from sql import Cast, Column, Literal
+from sql.functions import Round
+from sql.operators import Concat
+
+from trytond import backend
+from trytond.model import fields
+from trytond.i18n import gettext
+from trytond.exceptions import UserError
+
+# Field types which may be used and computed by an expression
+EXPRESSION_TYPES = {'integer', 'float', 'numeric', 'char', 'text'}
+_TEXT_TYPES = {'char', 'text'}
+_OPERATORS = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.truediv,
+    }
+
+
+class Expression(object):
+    '''
+    A restricted expression over the fields of a record.
+
+    It is made of numbers, strings, the names of the stored fields of the
+    record, the arithmetic operators and parentheses. The + operator
+    concatenates when one of its operands is a text. The value is null when
+    one of the fields is null.
+    It is translated into an SQL expression or evaluated in Python, both
+    rounding half away from zero. A division by a field is only evaluated in
+    Python, which reports the division by zero.
+    '''
+
+    def __init__(self, Model, text):
+        self.Model = Model
+        self.text = text
+        self.names = set()
+        try:
+            self.node = ast.parse(text.strip(), mode='eval').body
+            self._check(self.node)
+        except (SyntaxError, ValueError) as exception:
+            raise UserError(gettext('mass_editing.msg_invalid_expression',
+                    expression=text, error=exception))
+
+    def _check(self, node):
+        if isinstance(node, ast.Constant):
+            if (isinstance(node.value, bool)
+                    or not isinstance(node.value, (int, float, str))):
+                raise ValueError(repr(node.value))
+        elif isinstance(node, ast.Name):
+            field = self.Model._fields.get(node.id)
+            if (not field or field._type not in EXPRESSION_TYPES
+                    or isinstance(field, fields.Function)):
+                raise ValueError(node.id)
+            self.names.add(node.id)
+        elif isinstance(node, ast.BinOp) and type(node.op) in _OPERATORS:
+            self._check(node.left)
+            self._check(node.right)
+            if self._is_text(node) and not isinstance(node.op, ast.Add):
+                raise ValueError(ast.unparse(node))
+            if (isinstance(node.op, ast.Div)
+                    and self._constant(node.right) == 0):
+                raise ValueError(ast.unparse(node))
+        elif (isinstance(node, ast.UnaryOp)
+                and isinstance(node.op, (ast.UAdd, ast.USub))):
+            self._check(node.operand)
+            if self._is_text(node.operand):
+                raise ValueError(ast.unparse(node))
+        else:
+            raise ValueError(ast.unparse(node))
+
+    @staticmethod
+    def _constant(node):
+        "Return the value of a constant node or None"
+        sign = 1
+        if isinstance(node, ast.UnaryOp):
+            sign = -1 if isinstance(node.op, ast.USub) else 1
+            node = node.operand
+        if isinstance(node, ast.Constant) and not isinstance(node.value, str):
+            return sign * node.value
+
+    def _divides_by_field(self, node):
+        "Return if the node divides by an expression depending on a field"
+        if isinstance(node, ast.UnaryOp):
+            return self._divides_by_field(node.operand)
+        elif isinstance(node, ast.BinOp):
+            return ((isinstance(node.op, ast.Div)
+                    and self._constant(node.right) is None)
+                or self._divides_by_field(node.left)
+                or self._divides_by_field(node.right))
+        return False
+
+    def _is_text(self, node):
+        if isinstance(node, ast.Constant):
+            return isinstance(node.value, str)
+        elif isinstance(node, ast.Name):
+            return self.Model._fields[node.id]._type in _TEXT_TYPES
+        elif isinstance(node, ast.BinOp):
+            return self._is_text(node.left) or self._is_text(node.right)
+        return False
+
+    def is_sql(self, name):
+        '''
+        Return if the value for the field name can be computed by SQL without
+        skipping the validation of the field.
+        '''
+        field = self.Model._fields[name]
+        digits = getattr(field, 'digits', None)
+        return (not field.domain
+            and 'required' not in field.states
+            and not getattr(field, 'size', None)
+            and (digits is None or isinstance(digits, tuple))
+            and not self._divides_by_field(self.node)
+            and not any(getattr(self.Model._fields[n], 'translate', False)
+                for n in self.names))
+
+    def as_sql(self, table, name):
+        "Return the SQL expression of the value for the column name"
+        expression = self._sql(self.node, table)
+        field = self.Model._fields[name]
+        if field._type in {'integer', 'numeric'} and backend.name != 'sqlite':
+            # PostgreSQL rounds half away from zero only numeric values
+            expression = Cast(expression, 'NUMERIC')
+        if field._type == 'integer':
+            expression = Round(expression)
+        elif field._type == 'numeric':
+            digits = field.digits
+            if isinstance(digits, tuple) and digits[1] is not None:
+                expression = Round(expression, digits[1])
+        return expression
+
+    def _sql(self, node, table):
+        if isinstance(node, ast.Constant):
+            return Literal(node.value)
+        elif isinstance(node, ast.Name):
+            return Column(table, node.id)
+        elif isinstance(node, ast.UnaryOp):
+            operand = self._sql(node.operand, table)
+            return -operand if isinstance(node.op, ast.USub) else operand
+        left = self._sql(node.left, table)
+        right = self._sql(node.right, table)
+        if self._is_text(node):
+            return Concat(left, right)
+        elif isinstance(node.op, ast.Div):
+            # Do not divide integers as integers
+            type_ = 'REAL' if backend.name == 'sqlite' else 'NUMERIC'
+            left = Cast(left, type_)
+        return _OPERATORS[type(node.op)](left, right)
+
+    def evaluate(self, values, name):
+        "Return the value for the field name of the record values"
+        try:
+            value = self._evaluate(self.node, values)
+        except (ZeroDivisionError, InvalidOperation):
+            raise UserError(gettext(
+                    'mass_editing.msg_expression_zero_division',
+                    expression=self.text, record=values.get('id')))
+        if value is None:
+            return value
+        field = self.Model._fields[name]
+        if field._type == 'integer':
+            return int(Decimal(str(value)).quantize(
+                    Decimal(1), rounding=ROUND_HALF_UP))
+        elif field._type == 'float':
+            return float(value)
+        elif field._type == 'numeric':
+            value = Decimal(str(value))
+            digits = field.digits
+            if isinstance(digits, tuple) and digits[1] is not None:
+                value = value.quantize(
+                    Decimal(1).scaleb(-digits[1]), rounding=ROUND_HALF_UP)
+            return value
+        return str(value)
+
+    def _evaluate(self, node, values):
+        if isinstance(node, ast.Constant):
+            return node.value
+        elif isinstance(node, ast.Name):
+            return values[node.id]
+        elif isinstance(node, ast.UnaryOp):
+            operand = self._evaluate(node.operand, values)
+            if operand is None or isinstance(node.op, ast.UAdd):
+                return operand
+            return -operand
+        left = self._evaluate(node.left, values)
+        right = self._evaluate(node.right, values)
+        if left is None or right is None:
+            return None
+        if self._is_text(node):
+            return '%s%s' % (left, right)
+        if isinstance(left, Decimal) and isinstance(right, float):
+            right = Decimal(str(right))
+        elif isinstance(left, float) and isinstance(right, Decimal):
+            left = Decimal(str(left))
+        return _OPERATORS[type(node.op)](left, right)
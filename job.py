@@ -0,0 +1,565 @@
+# The COPYRIGHT file at the top level of this repository contains the full
+# copyright notices and license terms.
+import datetime
+import json
+import logging
+import time
+import traceback
+
+from trytond import backend
+from trytond.bus import notify
+from trytond.transaction import (
+    Transaction, check_access, without_check_access)
+from trytond.model import ModelView, ModelSQL, fields
+from trytond.pool import Pool
+from trytond.pyson import Eval, PYSONDecoder, PYSONEncoder
+from trytond.i18n import gettext
+from trytond.model.exceptions import AccessError
+
+logger = logging.getLogger(__name__)
+# The minimum number of seconds between two progress notifications
+PROGRESS_INTERVAL = 10
+
+
+def summarize(values):
+    "Return a line per operation of the wizard values"
+    lines = []
+    for key, value in sorted((values or {}).items()):
+        if key.startswith('selection_') and value:
+            field_name = key.split('_', 1)[1]
+            if value == 'compute':
+                new_value = values.get('expression_%s' % field_name)
+            else:
+                new_value = values.get(field_name, '')
+            lines.append('%s: %s %s' % (field_name, value, new_value))
+    return '\n'.join(lines)
+
+
+class Progress(object):
+    "The progress of the execution of a job"
+
+    def __init__(self, job):
+        self.job = job
+        self.chunks = 0
+        self.processed = 0
+        self.started = time.monotonic()
+        self.notified = None
+        self.time_left = None
+        self.estimated_end = None
+
+    def update(self, count):
+        "Add a chunk of count records processed and estimate the time left"
+        self.chunks += 1
+        self.processed += count
+        if self.job.total is None:
+            return
+        remaining = max(self.job.total - (self.job.processed or 0)
+            - (self.job.superseded or 0), 0)
+        elapsed = time.monotonic() - self.started
+        self.time_left = datetime.timedelta(
+            seconds=round(elapsed * remaining / self.processed))
+        self.estimated_end = datetime.datetime.now() + self.time_left
+
+    def notify(self):
+        '''
+        Notify the progress to the creator of the job on the bus
+
+        The notification is published from a new transaction, so it is
+        delivered without waiting for the transaction of the job to commit.
+        '''
+        now = time.monotonic()
+        if (self.notified is not None
+                and now - self.notified < PROGRESS_INTERVAL):
+            return
+        self.notified = now
+        job = self.job
+        title = gettext('mass_editing.msg_job_progress',
+            job=job.rec_name,
+            processed=job.processed or 0,
+            total=job.total if job.total is not None else '?')
+        body = gettext('mass_editing.msg_job_progress_body',
+            chunks=self.chunks,
+            skipped=job.skipped or 0,
+            time_left=self.time_left if self.time_left is not None else '?')
+        user = job.create_uid.id if job.create_uid else None
+        if backend.name == 'sqlite':
+            # The transactions share the connection of the database
+            notify(title, body=body, user=user)
+        else:
+            with Transaction().new_transaction():
+                notify(title, body=body, user=user)
+
+
+class MassEditJob(ModelSQL, ModelView):
+    'Mass Edit Job'
+    __name__ = 'mass.editing.job'
+    mass_edit = fields.Many2One('mass.editing', 'Mass Edit', required=True,
+        readonly=True, ondelete='CASCADE')
+    values = fields.Dict(None, 'Values', readonly=True)
+    record_ids = fields.Text('Records', readonly=True)
+    domain = fields.Char('Domain', readonly=True)
+    state = fields.Selection([
+            ('draft', 'Draft'),
+            ('enqueued', 'Enqueued'),
+            ('running', 'Running'),
+            ('done', 'Done'),
+            ('failed', 'Failed'),
+            ('cancelled', 'Cancelled'),
+            ], 'State', readonly=True, required=True)
+    skip_unchanged = fields.Boolean('Skip Unchanged', readonly=True)
+    skipped = fields.Integer('Skipped', readonly=True,
+        help='The records which already held the values.')
+    total = fields.Integer('Total', readonly=True)
+    processed = fields.Integer('Processed', readonly=True)
+    checkpoint = fields.Integer('Checkpoint', readonly=True)
+    estimated_end = fields.Timestamp('Estimated End', readonly=True,
+        states={
+            'invisible': Eval('state') != 'running',
+            })
+    failed_ids = fields.Text('Records Not Updated', readonly=True,
+        help='The ids of the records locked by other users.')
+    superseded = fields.Integer('Superseded', readonly=True,
+        help='The records left to newer jobs setting the same fields which '
+        'are merged into the same pass.')
+    log = fields.Text('Log', readonly=True)
+    parent = fields.Many2One('mass.editing.job', 'Parent', readonly=True,
+        ondelete='CASCADE')
+    partitions = fields.One2Many('mass.editing.job', 'parent', 'Partitions',
+        readonly=True)
+    merged_into = fields.Many2One('mass.editing.job', 'Merged Into',
+        readonly=True, ondelete='SET NULL',
+        help='The job which updates the records of this one in its pass.')
+    merged = fields.One2Many('mass.editing.job', 'merged_into', 'Merged Jobs',
+        readonly=True)
+    summary = fields.Function(fields.Text('Summary'), 'get_summary')
+
+    @classmethod
+    def __setup__(cls):
+        super(MassEditJob, cls).__setup__()
+        cls._order.insert(0, ('create_date', 'DESC'))
+        cls._order.insert(1, ('id', 'DESC'))
+        cls._buttons.update({
+                'enqueue': {
+                    'invisible': ~Eval('state').in_(
+                        ['draft', 'failed', 'cancelled']),
+                    'depends': ['state'],
+                    },
+                'cancel': {
+                    'invisible': ~Eval('state').in_(['enqueued', 'running']),
+                    'depends': ['state'],
+                    },
+                })
+
+    @staticmethod
+    def default_state():
+        return 'draft'
+
+    @staticmethod
+    def default_skip_unchanged():
+        return True
+
+    @staticmethod
+    def default_processed():
+        return 0
+
+    @staticmethod
+    def default_skipped():
+        return 0
+
+    @staticmethod
+    def default_superseded():
+        return 0
+
+    def get_rec_name(self, name):
+        return '%s (%s)' % (self.mass_edit.rec_name, self.id)
+
+    def get_summary(self, name):
+        return summarize(self.values)
+
+    @property
+    def target_ids(self):
+        "The ids of the records to update"
+        if self.record_ids is not None:
+            return json.loads(self.record_ids)
+
+    @property
+    def target_domain(self):
+        "The domain of the records to update"
+        if self.domain is not None:
+            return PYSONDecoder().decode(self.domain)
+
+    @property
+    def edited_fields(self):
+        "The names of the fields with an operation"
+        return {k.split('_', 1)[1] for k, v in (self.values or {}).items()
+            if k.startswith('selection_') and v}
+
+    @property
+    def absolute(self):
+        '''
+        If the values of the job do not depend on the values of the records,
+        so the job applied after another one gives its own values.
+        '''
+        pool = Pool()
+        EditingModel = pool.get(self.mass_edit.model.name)
+        for name in self.edited_fields:
+            field = EditingModel._fields.get(name)
+            if (field is None
+                    or field._type in {'one2many', 'many2many', 'dict'}
+                    or self.values['selection_%s' % name] not in {
+                        'set', 'remove'}):
+                return False
+        return True
+
+    def get_mergeable(self):
+        '''
+        Return the enqueued jobs of the same mass edit created after the job,
+        editing the same fields with absolute operations on listed records,
+        sorted by id.
+
+        The partitions are excluded, so the order of the ids is the order of
+        creation of the jobs.
+        '''
+        if (self.record_ids is None or self.parent or self.partitions
+                or self.checkpoint or not self.absolute):
+            return []
+        jobs = self.search([
+                ('mass_edit', '=', self.mass_edit.id),
+                ('id', '>', self.id),
+                ('state', '=', 'enqueued'),
+                ('record_ids', '!=', None),
+                ('parent', '=', None),
+                ('merged_into', '=', None),
+                ('skip_unchanged', '=', self.skip_unchanged),
+                ], order=[('id', 'ASC')])
+        edited = self.edited_fields
+        return [j for j in jobs if not j.partitions
+            and j.edited_fields == edited and j.absolute
+            and not j.cancel_requested()]
+
+    def get_merged(self):
+        "Return the running jobs merged into the job, sorted by id"
+        return self.search([
+                ('merged_into', '=', self.id),
+                ('state', '=', 'running'),
+                ], order=[('id', 'ASC')])
+
+    def merge(self):
+        '''
+        Merge the mergeable jobs into the job and return the jobs with the
+        ids of the records which get their values.
+
+        The last job created wins, so each record gets the values of the
+        newest job listing it and the records left by a job to a newer one
+        are counted and logged on it. The merged jobs are marked as running
+        until the job ends, so their own tasks leave them.
+        A merged pass restarts from the first record when its task is
+        retried, as its operations give the same result when applied twice.
+        '''
+        merged = self.get_merged()
+        if not merged:
+            merged = self.get_mergeable()
+            if not merged:
+                return [(self, self.target_ids)]
+            self.__class__.write(merged, {
+                    'merged_into': self.id,
+                    'state': 'running',
+                    })
+        jobs = [self] + sorted(merged, key=lambda j: j.id)
+        winners = {}
+        for job in jobs:
+            for id_ in job.target_ids:
+                winners[id_] = job
+        groups = []
+        for job in jobs:
+            ids = sorted(i for i, w in winners.items() if w == job)
+            lines = [gettext('mass_editing.msg_job_merged',
+                    job=self.rec_name)] if job != self else []
+            left = {}
+            for id_ in job.target_ids:
+                if winners[id_] != job:
+                    left.setdefault(winners[id_], set()).add(id_)
+            for winner, left_ids in sorted(left.items(),
+                    key=lambda i: i[0].id):
+                lines.append(gettext('mass_editing.msg_job_superseded',
+                        job=winner.rec_name, ids=', '.join(
+                            map(str, sorted(left_ids)))))
+            job.superseded = sum(map(len, left.values()))
+            job.log = '\n'.join(lines) or None
+            if ids:
+                groups.append((job, ids))
+        self.processed = self.skipped = 0
+        self.checkpoint = None
+        self.total = len(winners)
+        self.__class__.save(jobs)
+        return groups
+
+    @classmethod
+    def delete(cls, jobs):
+        for job in jobs:
+            if job.state in {'enqueued', 'running'}:
+                raise AccessError(gettext(
+                        'mass_editing.msg_job_delete_running',
+                        job=job.rec_name))
+        super(MassEditJob, cls).delete(jobs)
+
+    @classmethod
+    @ModelView.button
+    def enqueue(cls, jobs):
+        '''
+        Send the jobs to the queue to be processed by the worker.
+
+        The jobs of a mass edit with many parallel tasks are split into
+        partitions, each processed by its own task. The failed partitions are
+        sent again when their job is enqueued again and the cancelled ones
+        resume from their checkpoint.
+        '''
+        parents, to_process = [], []
+        for job in jobs:
+            partitions = job.partitions
+            if not partitions and not job.parent:
+                partitions = job.partition(job.mass_edit.parallel)
+            if partitions:
+                parents.append(job)
+                to_process.extend(p for p in partitions
+                    if p.state in {'draft', 'failed', 'cancelled'})
+            else:
+                to_process.append(job)
+        cls._clear_cancellations(parents + to_process)
+        if parents:
+            cls.write(parents, {'state': 'running'})
+        cls.write(to_process, {'state': 'enqueued', 'merged_into': None})
+        for job in to_process:
+            cls.__queue__.process([job])
+
+    @classmethod
+    @ModelView.button
+    def cancel(cls, jobs):
+        '''
+        Request the cancellation of the jobs.
+
+        The request is stored apart from the job, which is written by the
+        worker, and checked by the worker between chunks. So the chunks
+        already processed are kept and the job can be enqueued again to
+        resume from its checkpoint.
+        '''
+        pool = Pool()
+        Cancellation = pool.get('mass.editing.job.cancellation')
+        Cancellation.create([{'job': j.id} for j in jobs
+                if j.state in {'enqueued', 'running'}])
+
+    @without_check_access
+    def cancel_requested(self):
+        '''
+        Return if the cancellation of the job, of its parent or of a job
+        merged into it is requested
+
+        The cancellations are also searched in a new transaction, as the
+        snapshot of the transaction of a running job does not see those
+        requested after it started.
+        '''
+        pool = Pool()
+        Cancellation = pool.get('mass.editing.job.cancellation')
+        job_ids = [self.id]
+        if self.parent:
+            job_ids.append(self.parent.id)
+        job_ids.extend(j.id for j in self.get_merged())
+        domain = [('job', 'in', job_ids)]
+        if Cancellation.search(domain, limit=1):
+            return True
+        if backend.name == 'sqlite':
+            # The transactions share the connection of the database
+            return False
+        with Transaction().new_transaction(readonly=True):
+            return bool(Cancellation.search(domain, limit=1))
+
+    @classmethod
+    @without_check_access
+    def _clear_cancellations(cls, jobs):
+        pool = Pool()
+        Cancellation = pool.get('mass.editing.job.cancellation')
+        Cancellation.delete(Cancellation.search([
+                    ('job', 'in', [j.id for j in jobs]),
+                    ]))
+
+    def partition(self, count):
+        '''
+        Split the job into count jobs updating distinct ranges of ids.
+
+        So no record is updated by two partitions, the ids are sorted and
+        split in contiguous slices or, for a domain, the range between its
+        lowest and highest ids is split.
+        '''
+        pool = Pool()
+        EditingModel = pool.get(self.mass_edit.model.name)
+
+        if count <= 1:
+            return []
+        values = {
+            'mass_edit': self.mass_edit.id,
+            'values': self.values,
+            'skip_unchanged': self.skip_unchanged,
+            'parent': self.id,
+            }
+        partitions = []
+        if self.record_ids is not None:
+            ids = sorted(set(self.target_ids))
+            size = -(-len(ids) // count)
+            for i in range(0, len(ids), size):
+                sub_ids = ids[i:i + size]
+                partitions.append(dict(values,
+                        record_ids=json.dumps(sub_ids),
+                        total=len(sub_ids),
+                        ))
+        else:
+            domain = self.target_domain
+            bounds = [EditingModel.search(domain, order=[('id', order)],
+                    limit=1) for order in ['ASC', 'DESC']]
+            if not all(bounds):
+                return []
+            (first,), (last,) = bounds
+            size = -(-(last.id - first.id + 1) // count)
+            for start in range(first.id, last.id + 1, size):
+                partitions.append(dict(values,
+                        domain=PYSONEncoder().encode([domain,
+                                ('id', '>=', start),
+                                ('id', '<', start + size),
+                                ]),
+                        ))
+        if len(partitions) <= 1:
+            return []
+        return self.__class__.create(partitions)
+
+    @classmethod
+    def update_parents(cls, parents):
+        "Collect the progress and the errors of the partitions on parents"
+        for parent in parents:
+            partitions = cls.browse([p.id for p in parent.partitions])
+            states = {p.state for p in partitions}
+            if states & {'draft', 'enqueued', 'running'}:
+                parent.state = 'running'
+            elif 'failed' in states:
+                parent.state = 'failed'
+            elif 'cancelled' in states:
+                parent.state = 'cancelled'
+            else:
+                parent.state = 'done'
+            parent.processed = sum(p.processed or 0 for p in partitions)
+            parent.skipped = sum(p.skipped or 0 for p in partitions)
+            parent.superseded = sum(p.superseded or 0 for p in partitions)
+            failed_ids = sorted(i for p in partitions
+                for i in json.loads(p.failed_ids or '[]'))
+            parent.failed_ids = json.dumps(failed_ids) if failed_ids else None
+            parent.log = '\n'.join('%s:\n%s' % (p.rec_name, p.log)
+                for p in partitions if p.log) or None
+        cls.save(parents)
+        cls._clear_cancellations([p for p in parents if p.state != 'running'])
+
+    @classmethod
+    @without_check_access
+    def process(cls, jobs):
+        '''
+        Execute the jobs with the user and the access rights of their creator.
+
+        The enqueued jobs editing the same records are merged into the pass of
+        the job and get its final state.
+        '''
+        pool = Pool()
+        User = pool.get('res.user')
+        transaction = Transaction()
+        for job in jobs:
+            # A running job is resumed when its task is retried
+            if (job.state not in {'enqueued', 'running'} or job.partitions
+                    or job.merged_into):
+                continue
+            if job.cancel_requested():
+                job.state = 'cancelled'
+                job.save()
+                cls._clear_cancellations([job])
+                if job.parent:
+                    cls.update_parents([job.parent])
+                continue
+            job.state = 'running'
+            job.save()
+            creator = (job.parent or job).create_uid
+            user = creator.id if creator else transaction.user
+            try:
+                groups = job.merge()
+                merged = [g for g, _ in groups] != [job]
+                if merged and job.mass_edit.commit_chunks:
+                    # So the tasks of the merged jobs leave them
+                    transaction.commit()
+                result = dict.fromkeys(['processed', 'written', 'skipped'], 0)
+                result['failed'] = []
+                with transaction.set_user(user):
+                    context = User.get_preferences(context_only=True)
+                    with transaction.set_context(context), check_access():
+                        for group, ids in groups:
+                            if group != job:
+                                job.checkpoint = None
+                            group_result = job.mass_edit.execute(ids,
+                                group.values, job=job,
+                                domain=job.target_domain,
+                                skip_unchanged=job.skip_unchanged)
+                            for key in ['processed', 'written', 'skipped',
+                                    'failed']:
+                                result[key] += group_result[key]
+                            if group_result.get('cancelled'):
+                                result['cancelled'] = True
+                                break
+            except Exception:
+                logger.warning('Mass edit job %s failed', job.id,
+                    exc_info=True)
+                transaction.rollback()
+                job = cls(job.id)
+                job.state = 'failed'
+                job.estimated_end = None
+                job.log = traceback.format_exc()
+                job.save()
+                cls._end_merged(job)
+                if job.parent:
+                    cls.update_parents([job.parent])
+                transaction.commit()
+            else:
+                job.state = 'cancelled' if result.get('cancelled') else 'done'
+                job.estimated_end = None
+                job.failed_ids = (json.dumps(sorted(result['failed']))
+                    if result['failed'] else None)
+                job.save()
+                cls._end_merged(job, failed=result['failed'])
+                cls._clear_cancellations([job])
+                if job.parent:
+                    cls.update_parents([job.parent])
+
+    @classmethod
+    def _end_merged(cls, job, failed=None):
+        '''
+        Give the state of job to the jobs merged into it with the records they
+        won and detach the jobs which are not done, so they can be enqueued
+        again. A merged pass which is not done restarts from the first record.
+        '''
+        merged = job.get_merged()
+        if not merged:
+            return
+        if job.state != 'done':
+            job.checkpoint = None
+            job.processed = job.skipped = 0
+        for merged_job in merged:
+            ids = set(merged_job.target_ids)
+            failed_ids = sorted(ids.intersection(failed or []))
+            merged_job.state = job.state
+            merged_job.processed = (len(ids) - (merged_job.superseded or 0)
+                if job.state == 'done' else 0)
+            merged_job.failed_ids = (json.dumps(failed_ids)
+                if failed_ids else None)
+            if job.state != 'done':
+                merged_job.merged_into = None
+        cls.save([job] + merged)
+        cls._clear_cancellations(merged)
+
+
+class MassEditJobCancellation(ModelSQL):
+    'Mass Edit Job Cancellation'
+    __name__ = 'mass.editing.job.cancellation'
+    job = fields.Many2One('mass.editing.job', 'Job', required=True,
+        ondelete='CASCADE')
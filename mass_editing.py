@@ -1,18 +1,129 @@
 # The COPYRIGHT file at the top level of this repository contains the full
 # copyright notices and license terms.
+from contextlib import contextmanager, nullcontext
+from decimal import Decimal, InvalidOperation
 from lxml import etree
+import csv
+import datetime
+import hashlib
 import json
-
-from trytond.transaction import Transaction
+import logging
+import time
+from itertools import islice
+
+from sql import Cast, Column, Literal, Null
+from sql.aggregate import Count
+from sql.conditionals import Coalesce
+from sql.functions import CurrentTimestamp
+from sql.operators import Concat, Sub
+
+from trytond import backend
+from trytond.cache import Cache
+from trytond.transaction import Transaction, without_check_access
 from trytond.pool import Pool
+from trytond.protocols.jsonrpc import JSONEncoder
 from trytond.wizard import Wizard, StateView, StateTransition, Button
 from trytond.model import ModelView, ModelSQL, fields, Unique
-from trytond.pyson import Bool, Eval, PYSONEncoder
+from trytond.pyson import Bool, Eval, Id, If, PYSONDecoder, PYSONEncoder
+from trytond.rpc import RPC
+from trytond.tools import grouped_slice
 from trytond.i18n import gettext
 from trytond.exceptions import UserError
-from trytond.model.exceptions import ValidationError
+from trytond.model.exceptions import AccessError, ValidationError
+
+from .compute import ComputeFieldsMixin, deferred_compute
+from .execution import Metrics, phase
+from .expression import EXPRESSION_TYPES, Expression
+from .job import Progress, summarize
+from .validation import (
+    ValidateMixin, deferred_validation, validate_deferred)
+
+logger = logging.getLogger(__name__)
 
 PAGE_FIELDS = 8
+# Field types which may be updated directly by SQL
+_SQL_TYPES = [
+    'boolean', 'char', 'date', 'datetime', 'float', 'integer', 'many2one',
+    'numeric', 'selection', 'text', 'time', 'timestamp',
+    ]
+# Field types which can not be set from a CSV file
+_CSV_EXCLUDED_TYPES = {'one2many', 'many2many', 'dict', 'binary'}
+# The maximum number of unmatched keys and duplicate lines reported by a CSV
+# update
+CSV_UNMATCHED = 1000
+# Fields filled by the ORM on create and write
+_LOG_FIELDS = {'id', 'create_uid', 'create_date', 'write_uid', 'write_date'}
+# Methods which customize the write of a model and prevent to update its
+# records directly by SQL
+_WRITE_HOOKS = {
+    'write', 'check_modification', 'on_write', 'on_modification',
+    'validate', 'validate_fields', 'compute_fields', '_compute_fields',
+    }
+
+
+class FieldPlan(object):
+    '''
+    The precomputed description of a field edited by a mass edit.
+
+    It only stores names and flags, so it does not depend on the classes of
+    the pool.
+    '''
+    __slots__ = ('name', 'type', 'function', 'setter', 'xxx2many',
+        'one2many', 'dict', 'target_model', 'target_fields', 'sql')
+
+    def __init__(self, EditingModel, name, sql=False):
+        field = EditingModel._fields[name]
+        self.name = name
+        self.sql = sql and field._type in _SQL_TYPES
+        self.function = isinstance(field, fields.Function)
+        self.setter = bool(self.function and field.setter)
+        if self.setter:
+            field = field._field  # Use original field
+        self.type = field._type
+        self.one2many = isinstance(field, fields.One2Many)
+        self.xxx2many = (self.one2many
+            or isinstance(field, fields.Many2Many))
+        self.dict = isinstance(field, fields.Dict)
+        self.target_model = None
+        self.target_fields = frozenset()
+        if self.xxx2many:
+            TargetModel = field.get_target()
+            self.target_model = TargetModel.__name__
+            self.target_fields = frozenset(
+                n for n, f in TargetModel._fields.items()
+                if not isinstance(f, fields.Function) or f.setter)
+
+    def target_values(self, values):
+        "Return the values to create a target record from the wizard"
+        new_values = {}
+        for name, value in values.items():
+            if name not in self.target_fields:
+                continue
+            if isinstance(value, list):
+                value = [('add', value)]
+            new_values[name] = value
+        return new_values
+
+
+class EditPlan(object):
+    '''
+    The compiled fields of a model for a mass edit configuration.
+
+    Fields which are not part of the configuration are compiled on demand.
+    '''
+
+    def __init__(self, EditingModel, names, sql_names=None):
+        self.model = EditingModel.__name__
+        self.fields = {}
+        sql_names = set(sql_names or [])
+        for name in names:
+            self.fields[name] = FieldPlan(
+                EditingModel, name, sql=name in sql_names)
+
+    def __getitem__(self, name):
+        if name not in self.fields:
+            self.fields[name] = FieldPlan(Pool().get(self.model), name)
+        return self.fields[name]
 
 
 class MassEdit(ModelSQL, ModelView):
@@ -27,7 +138,105 @@ class MassEdit(ModelSQL, ModelView):
         domain=[
             ('model', '=', Eval('model_name')),
             ], order=[('field.string', 'ASC')])
+    sql_fields = fields.Many2Many('mass.editing.sql-ir.model.field',
+        'mass_edit', 'field', 'Direct SQL Fields',
+        domain=[
+            ('id', 'in', Eval('model_fields', [])),
+            ('ttype', 'in', _SQL_TYPES),
+            ],
+        help='The fields which are updated by a single SQL query instead of '
+        'the ORM when it is safe.\n'
+        'It skips the validation done in Python, so use it only for fields '
+        'without business logic.')
     keyword = fields.Many2One('ir.action.keyword', 'Keyword', readonly=True)
+    _plan_cache = Cache('mass_editing.edit_plan', context=False)
+    batch = fields.Boolean('Batch',
+        help='Update the records by chunks instead of all at once.\n'
+        'The background jobs are always updated by chunks to report their '
+        'progress and check their cancellation.')
+    chunk_size = fields.Integer('Chunk Size',
+        domain=[
+            If(Bool(Eval('batch')),
+                ('chunk_size', '>', 0),
+                ()),
+            ],
+        states={
+            'invisible': ~Eval('batch'),
+            'required': Bool(Eval('batch')),
+            },
+        help='The number of records updated on each chunk.')
+    commit_chunks = fields.Boolean('Commit Chunks',
+        states={
+            'invisible': ~Eval('batch'),
+            },
+        help='Commit the transaction after each chunk so a failure only '
+        'rolls back the current chunk.\n'
+        'The progress stored on a background job is only visible to the '
+        'other users when the chunks are committed.')
+    checkpoints = fields.One2Many('mass.editing.checkpoint', 'mass_edit',
+        'Checkpoints', readonly=True,
+        states={
+            'invisible': ~Eval('batch'),
+            },
+        help='The last record processed by an interrupted execution.\n'
+        'The next execution of the same values on the same records resumes '
+        'after it.')
+    lock = fields.Selection([
+            (None, 'Wait'),
+            ('defer', 'Defer Locked Records'),
+            ('skip', 'Skip Locked Records'),
+            ], 'Lock',
+        help='How to handle the records locked by other transactions.\n'
+        'Deferred records are retried after the others when the chunks are '
+        'committed and the skipped ones are reported as failed.\n'
+        'Only used by databases supporting row locks.')
+    lock_timeout = fields.Integer('Lock Timeout',
+        domain=['OR',
+            ('lock_timeout', '=', None),
+            ('lock_timeout', '>', 0),
+            ],
+        states={
+            'invisible': ~Eval('lock'),
+            },
+        help='The maximum time in milliseconds to wait for a lock.')
+    lock_retries = fields.Integer('Lock Retries',
+        domain=['OR',
+            ('lock_retries', '=', None),
+            ('lock_retries', '>=', 0),
+            ],
+        states={
+            'invisible': ~Eval('lock'),
+            },
+        help='The number of times the deferred records and the chunks '
+        'failing on concurrency errors are retried.\n'
+        'They are retried in a new transaction, so only when the chunks are '
+        'committed.')
+    parallel = fields.Integer('Parallel Tasks', required=True,
+        domain=[
+            ('parallel', '>', 0),
+            ],
+        help='The number of queue tasks among which the records of a '
+        'background execution are split.\n'
+        'Each task updates a distinct range of ids in its own transaction.')
+    recompute = fields.Selection([
+            (None, 'On Write'),
+            ('chunk', 'By Chunk'),
+            ('queue', 'In Queue'),
+            ], 'Recompute',
+        help='When the stored fields computed from the edited fields are '
+        'updated.\n'
+        'By chunk, they are computed once for all the records of a chunk.\n'
+        'In queue, they are computed by a queue task after the chunk is '
+        'committed.')
+    validation = fields.Selection([
+            (None, 'On Write'),
+            ('chunk', 'By Chunk'),
+            ], 'Validation',
+        help='When the written records are validated.\n'
+        'By chunk, they are validated once for all the writes of a chunk '
+        'and only the triggers depending on the edited fields are '
+        'evaluated.')
+    presets = fields.One2Many('mass.editing.preset', 'mass_edit', 'Presets')
 
     @classmethod
     def __setup__(cls):
@@ -44,8 +253,43 @@ class MassEdit(ModelSQL, ModelView):
                 'remove_keyword': {
                     'invisible': ~Bool(Eval('keyword')),
                     },
+                'reset_checkpoint': {
+                    'invisible': ~Eval('checkpoints', []),
+                    'depends': ['checkpoints'],
+                    },
+                })
+        cls.__rpc__.update({
+                'apply': RPC(readonly=False),
                 })
 
+    @staticmethod
+    def default_batch():
+        return False
+
+    @staticmethod
+    def default_chunk_size():
+        return 1000
+
+    @staticmethod
+    def default_commit_chunks():
+        return False
+
+    @staticmethod
+    def default_parallel():
+        return 1
+
+    @staticmethod
+    def default_recompute():
+        return None
+
+    @staticmethod
+    def default_lock_timeout():
+        return 5000
+
+    @staticmethod
+    def default_lock_retries():
+        return 3
+
     @classmethod
     def validate(cls, massedits):
         super(MassEdit, cls).validate(massedits)
@@ -62,6 +306,14 @@ class MassEdit(ModelSQL, ModelView):
     def search_rec_name(cls, name, clause):
         return [('model.rec_name',) + tuple(clause[1:])]
 
+    @classmethod
+    def on_modification(cls, mode, records, field_names=None):
+        pool = Pool()
+        MassEditWizardStart = pool.get('mass.editing.wizard.start')
+        super().on_modification(mode, records, field_names=field_names)
+        MassEditWizardStart._view_cache.clear()
+        cls._plan_cache.clear()
+
     @fields.depends('model')
     def on_change_with_model_name(self, name=None):
         return self.model and self.model.name
@@ -94,11 +346,1197 @@ class MassEdit(ModelSQL, ModelView):
         Keyword = pool.get('ir.action.keyword')
         Keyword.delete([x.keyword for x in massedits if x.keyword])
 
+    @classmethod
+    @ModelView.button
+    def reset_checkpoint(cls, massedits):
+        pool = Pool()
+        Checkpoint = pool.get('mass.editing.checkpoint')
+        Checkpoint.delete([c for m in massedits for c in m.checkpoints])
+
     @classmethod
     def delete(cls, massedits):
         cls.remove_keyword(massedits)
         super(MassEdit, cls).delete(massedits)
 
+    @classmethod
+    def apply(cls, model, values, ids=None, domain=None, background=False,
+            skip_unchanged=True):
+        '''
+        Apply the values on the records of model with ids or matching domain,
+        exactly one of them must be given.
+
+        values is a dictionary with the selection_<field> operations and the
+        field values as filled on the wizard.
+        When background is set, the edit is stored as a job and sent to the
+        queue and the job id is returned.
+        When skip_unchanged is set, the records already holding the values
+        are not written.
+        Return the result of execute or the job id.
+        '''
+        pool = Pool()
+        Job = pool.get('mass.editing.job')
+        ModelAccess = pool.get('ir.model.access')
+        if (ids is None) == (domain is None):
+            raise UserError(gettext('mass_editing.msg_apply_target'))
+        edits = cls.search([('model.name', '=', model)], limit=1)
+        if not edits:
+            return
+        edit, = edits
+        if domain is not None and isinstance(domain, str):
+            domain = PYSONDecoder().decode(domain)
+        if ids is not None:
+            ids = sorted(set(ids))
+        if not background:
+            return edit.execute(ids, values, domain=domain,
+                skip_unchanged=skip_unchanged)
+
+        # Report the access errors now instead of on the job, which is
+        # processed with the access rights of its creator
+        EditingModel = pool.get(model)
+        ModelAccess.check(model, 'write')
+        if domain is not None:
+            total = EditingModel.search_count(domain)
+            record_ids, domain = None, PYSONEncoder().encode(domain)
+        else:
+            cls._check_write_rule(EditingModel, ids)
+            total = len(ids)
+            record_ids = json.dumps(ids)
+        with without_check_access():
+            job = Job(
+                mass_edit=edit,
+                values=values,
+                record_ids=record_ids,
+                domain=domain,
+                total=total,
+                skip_unchanged=skip_unchanged,
+                )
+            job.save()
+            Job.enqueue([job])
+        return job.id
+
+    @classmethod
+    def _check_write_rule(cls, EditingModel, ids):
+        "Raise an AccessError if the rules do not allow to write the ids"
+        pool = Pool()
+        Rule = pool.get('ir.rule')
+        domain = Rule.domain_get(EditingModel.__name__, mode='write')
+        if not domain:
+            return
+        allowed = set()
+        for sub_ids in grouped_slice(ids, backend.MAX_QUERY_PARAMS):
+            allowed.update(map(int, EditingModel.search([
+                            ('id', 'in', list(sub_ids)),
+                            domain,
+                            ])))
+        denied = [i for i in ids if i not in allowed]
+        if denied:
+            raise AccessError(gettext('mass_editing.msg_write_rule',
+                    model=EditingModel.__name__,
+                    ids=', '.join(map(str, denied[:10]))))
+
+    def execute(self, ids, values, job=None, domain=None,
+            skip_unchanged=True):
+        '''
+        Apply the values of the wizard to the records of ids or, when ids is
+        None, to the records matching domain.
+
+        On batch mode the records are updated by chunks in ascending id order
+        and the last processed id is stored as checkpoint of the run, so an
+        interrupted execution of the same values on the same records resumes
+        where it stopped. The checkpoints of other runs are removed.
+        When a job is given, the records are updated by chunks even without
+        batch mode and the checkpoint and the progress are kept on it.
+        When skip_unchanged is set, the records already holding the values
+        are not written.
+        The previous values of the written records are stored on an undo log
+        and the metrics of the execution are stored on its history.
+        When a lock mode is set, the records locked by other transactions
+        are deferred to retry passes or skipped, and the chunks failing on
+        concurrency errors are retried when the chunks are committed.
+        When a job is given, its progress is notified to its creator and the
+        execution stops between chunks if its cancellation is requested.
+        Return a dictionary with the number of records processed, written and
+        skipped and the list of ids which could not be updated (failed).
+        The dictionary of a stopped execution also holds cancelled.
+        '''
+        pool = Pool()
+        Execution = pool.get('mass.editing.execution')
+        EditingModel = pool.get(self.model.name)
+
+        run, checkpoint = None, None
+        if job:
+            checkpoint = job.checkpoint
+        elif self.batch:
+            run = self._start_run(values, ids, domain)
+            checkpoint = run.checkpoint
+        if not self.batch and not job:
+            checkpoint = None
+        plan = self.get_plan()
+        result = dict.fromkeys(['processed', 'written', 'skipped'], 0)
+        result['failed'] = []
+        undo = None
+        if job and job.total is None and domain is not None:
+            self._count_job(EditingModel, job, domain, checkpoint)
+        progress = Progress(job) if job else None
+        with Metrics('mass_editing.execute') as metrics:
+            deferred = []
+            for sub_ids in self._iter_chunks(
+                    EditingModel, ids, domain, checkpoint,
+                    chunked=job is not None):
+                to_write, locked, failed, undo = self._write_chunk(
+                    EditingModel, sub_ids, values, plan, skip_unchanged,
+                    undo=undo, job=job)
+                skipped = len(sub_ids) - len(to_write) - len(locked) - len(
+                    failed)
+                if self.lock == 'defer' and self._can_retry():
+                    deferred.extend(locked)
+                else:
+                    failed.extend(locked)
+                result['processed'] += len(sub_ids)
+                result['written'] += len(to_write)
+                result['skipped'] += skipped
+                result['failed'].extend(failed)
+                with phase('checkpoint'):
+                    self._chunk_done(sub_ids, job=job, skipped=skipped,
+                        progress=progress, run=run)
+                if job and job.cancel_requested():
+                    logger.info('Mass edit job %s cancelled', job.id)
+                    result['cancelled'] = True
+                    break
+
+            # The deferred records are before the checkpoint and each retry
+            # starts a new transaction
+            count = self.chunk_size or self.default_chunk_size()
+            for attempt in range(self.lock_retries or 0):
+                if not deferred or result.get('cancelled'):
+                    break
+                time.sleep(self._backoff(attempt))
+                pending, deferred = deferred, []
+                for sub_ids in grouped_slice(pending, count):
+                    sub_ids = list(sub_ids)
+                    to_write, locked, failed, undo = self._write_chunk(
+                        EditingModel, sub_ids, values, plan, skip_unchanged,
+                        undo=undo, job=job)
+                    deferred.extend(locked)
+                    result['written'] += len(to_write)
+                    result['skipped'] += (len(sub_ids) - len(to_write)
+                        - len(locked) - len(failed))
+                    result['failed'].extend(failed)
+            result['failed'].extend(deferred)
+            result['failed'].sort()
+            if run is not None and run.id is not None:
+                self._end_run(run)
+        Execution.register(self, metrics, result, job=job)
+        return result
+
+    def _write_chunk(self, EditingModel, ids, values, plan, skip_unchanged,
+            undo=None, job=None):
+        '''
+        Write the values on the records of ids.
+
+        Return the ids written, the ids locked by other transactions, the ids
+        which failed on concurrency errors and the undo log.
+        On lock mode and when the database supports row locks, the rows are
+        locked skipping those locked by others and a chunk failing on a
+        concurrency error is rolled back. When the chunks are committed, the
+        chunk is retried with a backoff in a new transaction, so with a new
+        snapshot of the database.
+        '''
+        pool = Pool()
+        Undo = pool.get('mass.editing.undo')
+
+        locking = self.lock and Transaction().database.has_select_for()
+        retry = self._can_retry()
+        attempts = (self.lock_retries or 0) if retry else 0
+        if retry:
+            # Only the chunk is rolled back on failure
+            Transaction().commit()
+        undo_id = undo.id if undo else None
+        for attempt in range(attempts + 1):
+            try:
+                with (self._savepoint() if locking and not retry
+                        else nullcontext()):
+                    locked = []
+                    available = ids
+                    if locking:
+                        with phase('lock', len(ids)):
+                            available = self._lock_records(EditingModel, ids)
+                        locked = [i for i in ids if i not in available]
+                        available = [i for i in ids if i in available]
+                    to_write = available
+                    if skip_unchanged and available:
+                        with phase('filter', len(available)):
+                            to_write = self._filter_unchanged(
+                                EditingModel, available, values, plan)
+                    if to_write:
+                        with phase('undo', len(to_write)):
+                            undo = Undo.capture(self, EditingModel, to_write,
+                                values, plan, undo=undo, job=job)
+                        with phase('write', len(to_write)), (
+                                deferred_compute(EditingModel)
+                                if self.recompute else nullcontext()
+                                ) as deferred, (
+                                deferred_validation(EditingModel,
+                                    self._get_trigger_fields(
+                                        EditingModel, values))
+                                if self.validation == 'chunk'
+                                else nullcontext()) as validating:
+                            self._execute_chunk(
+                                EditingModel, to_write, values, plan)
+                        if validating:
+                            with phase('validate', len(validating.ids)):
+                                validate_deferred(EditingModel, validating)
+                        if deferred:
+                            self._recompute(EditingModel, deferred)
+                return to_write, locked, [], undo
+            except backend.DatabaseOperationalError:
+                if not locking:
+                    raise
+                if retry:
+                    self._rollback()
+                # The changes of the undo log are also rolled back
+                undo = Undo(undo_id) if undo_id else None
+                if attempt >= attempts:
+                    logger.warning('Mass edit %s failed to update %s records',
+                        self.id, len(ids), exc_info=True)
+                    return [], [], ids, undo
+                time.sleep(self._backoff(attempt))
+
+    def _can_retry(self):
+        "Return if the chunks can be retried in a new transaction"
+        return bool(self.lock and self.batch and self.commit_chunks
+            and Transaction().database.has_select_for())
+
+    def _get_trigger_fields(self, EditingModel, values):
+        '''
+        Return the fields written by values on which the write triggers
+        depend or None when the stored fields are computed by the writes.
+        '''
+        if not self.recompute and EditingModel.has_compute_fields():
+            return None
+        return {k.split('_', 1)[1] for k, v in values.items()
+            if k.startswith('selection_') and v}
+
+    def _recompute(self, EditingModel, deferred):
+        '''
+        Compute the stored fields of the records collected by deferred or
+        send their computation to the queue.
+        '''
+        if not deferred.ids or not EditingModel.has_compute_fields():
+            return
+        records = EditingModel.browse(sorted(deferred.ids))
+        field_names = deferred.field_names
+        if field_names is not None:
+            field_names = sorted(field_names)
+        if self.recompute == 'queue':
+            EditingModel.__queue__.mass_edit_compute_fields(
+                records, field_names)
+        else:
+            with phase('recompute', len(records)):
+                EditingModel.mass_edit_compute_fields(records, field_names)
+
+    def _lock_records(self, EditingModel, ids):
+        "Lock the rows of ids not locked by others and return their ids"
+        transaction = Transaction()
+        database = transaction.database
+        cursor = transaction.connection.cursor()
+        if not self._is_table(EditingModel):
+            return set(ids)
+
+        if self.lock_timeout:
+            cursor.execute('SELECT set_config(\'lock_timeout\', %s, true)',
+                ('%sms' % self.lock_timeout,))
+        table = EditingModel.__table__()
+        For = database.get_select_for_skip_locked()
+        available = set()
+        for sub_ids in grouped_slice(ids, backend.MAX_QUERY_PARAMS):
+            cursor.execute(*table.select(table.id,
+                    where=fields.SQL_OPERATORS['in'](
+                        table.id, list(sub_ids)),
+                    for_=For('UPDATE')))
+            available.update(i for i, in cursor)
+        return available
+
+    @staticmethod
+    @contextmanager
+    def _savepoint(name='mass_editing'):
+        "Roll back the queries of the block to a savepoint when it fails"
+        transaction = Transaction()
+        cursor = transaction.connection.cursor()
+        cursor.execute('SAVEPOINT %s' % name)
+        try:
+            yield
+        except Exception:
+            cursor.execute('ROLLBACK TO SAVEPOINT %s' % name)
+            for cache in transaction.cache.values():
+                cache.clear()
+            transaction.counter += 1
+            raise
+        else:
+            cursor.execute('RELEASE SAVEPOINT %s' % name)
+
+    @staticmethod
+    def _rollback():
+        "Roll back the transaction and clear its caches"
+        transaction = Transaction()
+        transaction.rollback()
+        for cache in transaction.cache.values():
+            cache.clear()
+        transaction.counter += 1
+
+    @staticmethod
+    def _backoff(attempt):
+        "Return the seconds to wait before the retry attempt"
+        return 0.1 * 2 ** attempt
+
+    def execute_csv(self, lines, key='id', delimiter=',',
+            skip_unchanged=True):
+        '''
+        Update the records with the values of the CSV lines.
+
+        The first line holds the name of the key column, which is the id or a
+        field identifying the records, and the names of the fields to set.
+        The non empty lines are read by chunks and the records of a chunk
+        sharing the same values are written together, so only the keys of
+        the file are kept in memory.
+        The first line of a key wins: the lines repeating the key of a
+        previous line of the file are not applied and reported as duplicates.
+        Return a dictionary with the number of lines processed, the number of
+        records written and skipped, the ids which could not be updated
+        (failed), the number of keys without record (unmatched) and the first
+        of these keys (unmatched_keys), the number of duplicate lines
+        (duplicates) and the first of their numbers (duplicate_lines).
+        '''
+        pool = Pool()
+        Execution = pool.get('mass.editing.execution')
+        EditingModel = pool.get(self.model.name)
+
+        reader = csv.reader(lines, delimiter=delimiter)
+        header = next(reader, None)
+        if not header or key not in header:
+            raise UserError(gettext('mass_editing.msg_csv_key', key=key))
+        names = [n for n in header if n != key]
+        allowed = {f.name for f in self.model_fields
+            if f.ttype not in _CSV_EXCLUDED_TYPES}
+        for name in names:
+            if name not in allowed:
+                raise UserError(gettext('mass_editing.msg_csv_field',
+                        field=name, model=self.model.rec_name))
+        if key != 'id' and key not in EditingModel._fields:
+            raise UserError(gettext('mass_editing.msg_csv_key', key=key))
+        key_index = header.index(key)
+        indexes = [header.index(n) for n in names]
+
+        plan = self.get_plan()
+        count = self.chunk_size or self.default_chunk_size()
+        result = dict.fromkeys(
+            ['processed', 'written', 'skipped', 'unmatched', 'duplicates'], 0)
+        result['failed'], result['unmatched_keys'] = [], []
+        result['duplicate_lines'] = []
+        undo = None
+        seen = set()
+        with Metrics('mass_editing.execute_csv') as metrics:
+            # grouped_slice would read all the lines at once
+            numbered = ((line, row) for line, row in enumerate(reader, 2)
+                if any(row))
+            while True:
+                rows = list(islice(numbered, count))
+                if not rows:
+                    break
+                values = {}
+                for line, row in rows:
+                    result['processed'] += 1
+                    try:
+                        key_value = self._parse_csv(
+                            EditingModel, key, row[key_index])
+                        value = tuple(
+                            self._parse_csv(EditingModel, n, row[i])
+                            for n, i in zip(names, indexes))
+                    except (ValueError, IndexError, InvalidOperation):
+                        raise UserError(gettext('mass_editing.msg_csv_line',
+                                line=line))
+                    if key_value in seen:
+                        result['duplicates'] += 1
+                        if len(result['duplicate_lines']) < CSV_UNMATCHED:
+                            result['duplicate_lines'].append(line)
+                        continue
+                    seen.add(key_value)
+                    values[key_value] = value
+                with phase('search', len(values)):
+                    matches = self._match_csv(EditingModel, key, values)
+                unmatched = [k for k in values if k not in matches]
+                result['unmatched'] += len(unmatched)
+                result['unmatched_keys'].extend(unmatched[:max(
+                            0, CSV_UNMATCHED - len(result['unmatched_keys']))])
+
+                groups = {}
+                for key_value, ids in matches.items():
+                    groups.setdefault(values[key_value], []).extend(ids)
+                for value, ids in groups.items():
+                    edit_values = {}
+                    for name, field_value in zip(names, value):
+                        edit_values['selection_%s' % name] = 'set'
+                        edit_values[name] = field_value
+                    to_write, locked, failed, undo = self._write_chunk(
+                        EditingModel, sorted(ids), edit_values, plan,
+                        skip_unchanged, undo=undo)
+                    result['written'] += len(to_write)
+                    result['skipped'] += (len(ids) - len(to_write)
+                        - len(locked) - len(failed))
+                    result['failed'].extend(locked + failed)
+                if self.batch and self.commit_chunks:
+                    Transaction().commit()
+        result['failed'].sort()
+        Execution.register(self, metrics, result)
+        return result
+
+    @classmethod
+    def _parse_csv(cls, EditingModel, name, text):
+        "Return the value of the field name for the text of a CSV cell"
+        text = text.strip()
+        if name == 'id':
+            return int(text)
+        type_ = EditingModel._fields[name]._type
+        if text == '':
+            return text if type_ in {'char', 'text'} else None
+        if type_ == 'boolean':
+            return text.lower() in {'1', 'true', 'yes', 'y', 'x'}
+        elif type_ in {'integer', 'many2one', 'one2one'}:
+            return int(text)
+        elif type_ == 'float':
+            return float(text)
+        elif type_ == 'numeric':
+            return Decimal(text)
+        elif type_ == 'date':
+            return datetime.date.fromisoformat(text)
+        elif type_ in {'datetime', 'timestamp'}:
+            return datetime.datetime.fromisoformat(text)
+        elif type_ == 'time':
+            return datetime.time.fromisoformat(text)
+        elif type_ == 'multiselection':
+            return tuple(v.strip() for v in text.split(','))
+        return text
+
+    @classmethod
+    def _match_csv(cls, EditingModel, key, values):
+        "Return for each key of values the ids of the matching records"
+        matches = {}
+        with Transaction().set_context(active_test=False):
+            for sub_keys in grouped_slice(
+                    list(values), backend.MAX_QUERY_PARAMS):
+                records = EditingModel.search([(key, 'in', list(sub_keys))])
+                if key == 'id':
+                    for record in records:
+                        matches[record.id] = [record.id]
+                    continue
+                for record in EditingModel.read(
+                        list(map(int, records)), [key]):
+                    matches.setdefault(record[key], []).append(record['id'])
+        return matches
+
+    def preview(self, values, ids=None, domain=None, sample_size=5):
+        '''
+        Return the impact of applying the values without writing them.
+
+        The result is a dictionary with the number of records (total), the
+        number of records already holding the values (unchanged), the number
+        of related rows removed by remove_all (related) and a text with the
+        values before and after for a sample of the records (sample).
+        '''
+        pool = Pool()
+        EditingModel = pool.get(self.model.name)
+        plan = self.get_plan()
+        unchanged_domain = self._get_unchanged_domain(values, plan)
+        remove_all = [k.split('_', 1)[1] for k, v in values.items()
+            if k.startswith('selection_') and v == 'remove_all']
+
+        unchanged = 0
+        if domain is not None:
+            total = EditingModel.search_count(domain)
+            if unchanged_domain:
+                unchanged = EditingModel.search_count(
+                    [domain, unchanged_domain])
+            sample_ids = list(map(int, EditingModel.search(domain,
+                        order=[('id', 'ASC')], limit=sample_size)))
+        else:
+            ids = sorted(set(ids))
+            total = len(ids)
+            if unchanged_domain:
+                for sub_ids in grouped_slice(ids, backend.MAX_QUERY_PARAMS):
+                    unchanged += EditingModel.search_count([
+                            ('id', 'in', list(sub_ids)),
+                            unchanged_domain,
+                            ])
+            sample_ids = ids[:sample_size]
+
+        related = 0
+        if remove_all or not unchanged_domain:
+            for sub_ids in self._iter_chunks(EditingModel, ids, domain):
+                for name in remove_all:
+                    related += self._count_xxx2many(
+                        EditingModel, name, sub_ids)
+                if not unchanged_domain:
+                    unchanged += len(sub_ids) - len(self._filter_unchanged(
+                            EditingModel, sub_ids, values, plan))
+
+        return {
+            'total': total,
+            'unchanged': unchanged,
+            'related': related,
+            'sample': self._get_sample(EditingModel, sample_ids, values,
+                plan),
+            }
+
+    @classmethod
+    def _get_unchanged_domain(cls, values, plan):
+        '''
+        Return the domain of the records already holding the values or None
+        when it can not be expressed by a domain.
+        '''
+        domain = []
+        for key, value in values.items():
+            if not key.startswith('selection_') or not value:
+                continue
+            name = key.split('_', 1)[1]
+            field = plan[name]
+            if field.xxx2many or field.dict or field.function:
+                return
+            if value == 'set':
+                domain.append((name, '=', values.get(name)))
+            elif value == 'remove':
+                domain.append((name, '=', None))
+            else:
+                return
+        return domain or None
+
+    @classmethod
+    def _filter_unchanged(cls, EditingModel, ids, values, plan):
+        '''
+        Return the ids of the records which do not hold yet the values.
+
+        Stored columns are compared by a search, xxx2many fields by comparing
+        the set of related ids and dict fields by comparing their items.
+        '''
+        domain = []
+        checks = []
+        for key, operation in values.items():
+            if not key.startswith('selection_') or not operation:
+                continue
+            name = key.split('_', 1)[1]
+            field = plan[name]
+            value = values.get(name)
+            if field.xxx2many:
+                value = value or []
+                if any(isinstance(v, dict) for v in value):
+                    # New records are always created
+                    return ids
+                value = set(value)
+                with phase('diff', len(ids)):
+                    related = cls._get_xxx2many_map(EditingModel, name, ids)
+                if operation == 'set':
+                    checks.append(lambda i, r=related, v=value: r[i] == v)
+                elif operation == 'add':
+                    checks.append(lambda i, r=related, v=value: v <= r[i])
+                elif operation == 'remove':
+                    checks.append(
+                        lambda i, r=related, v=value: not (v & r[i]))
+                elif operation == 'remove_all':
+                    checks.append(lambda i, r=related: not r[i])
+                else:
+                    return ids
+            elif field.dict:
+                if operation != 'set':
+                    return ids
+                current = {}
+                for sub_ids in grouped_slice(ids, backend.MAX_QUERY_PARAMS):
+                    for record in EditingModel.read(list(sub_ids), [name]):
+                        current[record['id']] = record[name] or {}
+
+                def check(i, c=current, v=value or {}):
+                    return all(c[i].get(k) == w if w is not None
+                        else k not in c[i] for k, w in v.items())
+                checks.append(check)
+            elif field.function:
+                return ids
+            elif operation == 'set':
+                domain.append((name, '=', value))
+            elif operation == 'remove':
+                domain.append((name, '=', None))
+            else:
+                return ids
+
+        unchanged = set(ids)
+        if domain:
+            unchanged = set()
+            for sub_ids in grouped_slice(ids, backend.MAX_QUERY_PARAMS):
+                unchanged.update(map(int, EditingModel.search([
+                                ('id', 'in', list(sub_ids)),
+                                domain,
+                                ])))
+        for check in checks:
+            unchanged = {i for i in unchanged if check(i)}
+        return [i for i in ids if i not in unchanged]
+
+    @classmethod
+    def _get_xxx2many_map(cls, EditingModel, name, ids):
+        "Return for each record of ids the set of ids linked by field name"
+        cursor = Transaction().connection.cursor()
+        result = {i: set() for i in ids}
+        relation = cls._get_xxx2many_relation(EditingModel, name)
+        if relation is None:
+            for sub_ids in grouped_slice(ids, backend.MAX_QUERY_PARAMS):
+                for values in EditingModel.read(list(sub_ids), [name]):
+                    result[values['id']].update(values[name] or [])
+            return result
+
+        table, origin, type_, target, where = relation
+        for sub_ids in grouped_slice(ids, backend.MAX_QUERY_PARAMS):
+            clause = cls._origin_clause(EditingModel, origin, type_, sub_ids)
+            cursor.execute(*table.select(origin, target,
+                    where=clause & where))
+            for origin_id, target_id in cursor:
+                if type_ == 'reference':
+                    origin_id = int(origin_id.split(',', 1)[1])
+                result[origin_id].add(target_id)
+        return result
+
+    @classmethod
+    def _get_sample(cls, EditingModel, ids, values, plan):
+        "Return a text with the values before and after for the records"
+        names = [k.split('_', 1)[1] for k, v in sorted(values.items())
+            if k.startswith('selection_') and v]
+        names = [n for n in names if not plan[n].xxx2many]
+        if not names or not ids:
+            return ''
+
+        def format_(name, value):
+            field = EditingModel._fields[name]
+            if value is not None and field._type == 'many2one':
+                Target = field.get_target()
+                return Target(value).rec_name
+            return str(value)
+
+        expressions = {n: Expression(EditingModel,
+                values.get('expression_%s' % n) or '') for n in names
+            if values['selection_%s' % n] == 'compute'}
+        read_names = set(names).union(
+            *(e.names for e in expressions.values()))
+
+        lines = []
+        for record in EditingModel.read(ids, ['rec_name'] + list(read_names)):
+            lines.append(record['rec_name'])
+            for name in names:
+                operation = values['selection_%s' % name]
+                new_value = None
+                if operation == 'set':
+                    new_value = values.get(name)
+                    if plan[name].dict:
+                        new_value = cls._merged(record[name], new_value)
+                elif operation == 'compute':
+                    new_value = expressions[name].evaluate(record, name)
+                lines.append('    %s: %s -> %s' % (name,
+                        format_(name, record[name]),
+                        format_(name, new_value)))
+        return '\n'.join(lines)
+
+    def get_plan(self):
+        "Return the EditPlan of the edit compiled once and cached"
+        key = (self.model.name, self.id, self.write_date or self.create_date)
+        plan = self._plan_cache.get(key)
+        if plan is None:
+            names = [f.name for f in self.model_fields]
+            sql_names = [f.name for f in self.sql_fields]
+            plan = self._plan_cache.set(key,
+                EditPlan(Pool().get(self.model.name), names, sql_names))
+        return plan
+
+    def _iter_chunks(self, EditingModel, ids, domain, checkpoint=None,
+            chunked=False):
+        '''
+        Yield the lists of ids to update by chunk in ascending order.
+
+        The ids are split by chunks on batch mode or when chunked is set.
+        The records matching a domain are searched chunk by chunk using the
+        last id as key so the full list of ids is never built.
+        '''
+        if self.batch or chunked or domain is not None:
+            count = self.chunk_size or self.default_chunk_size()
+        else:
+            count = len(ids)
+
+        if domain is None:
+            ids = sorted(set(ids))
+            if checkpoint:
+                ids = [i for i in ids if i > checkpoint]
+            for sub_ids in grouped_slice(ids, count):
+                yield list(sub_ids)
+            return
+
+        last_id = checkpoint or 0
+        while True:
+            with phase('search'):
+                records = EditingModel.search(
+                    [domain, ('id', '>', last_id)],
+                    order=[('id', 'ASC')], limit=count)
+            if not records:
+                break
+            sub_ids = list(map(int, records))
+            yield sub_ids
+            last_id = sub_ids[-1]
+
+    @without_check_access
+    def _chunk_done(self, ids, job=None, skipped=0, progress=None,
+            run=None):
+        if job:
+            job.processed = (job.processed or 0) + len(ids)
+            job.skipped = (job.skipped or 0) + skipped
+            job.checkpoint = ids[-1]
+            if progress:
+                progress.update(len(ids))
+                job.estimated_end = progress.estimated_end
+            job.save()
+            if progress:
+                progress.notify()
+            if self.batch and self.commit_chunks:
+                Transaction().commit()
+        elif run is not None:
+            run.checkpoint = ids[-1]
+            run.save()
+            if self.commit_chunks:
+                Transaction().commit()
+
+    def _count_job(self, EditingModel, job, domain, checkpoint=None):
+        "Store the total of the job updating the records of domain"
+        with phase('search'):
+            count = EditingModel.search_count(
+                [domain, ('id', '>', checkpoint or 0)])
+        job.total = (job.processed or 0) + count
+        with without_check_access():
+            job.save()
+
+    @staticmethod
+    def _run_key(values, ids, domain):
+        "Return the digest identifying the run of values on ids or domain"
+        if ids is not None:
+            ids = sorted(set(ids))
+        data = json.dumps([values, ids, domain], cls=JSONEncoder,
+            sort_keys=True)
+        return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+    @without_check_access
+    def _start_run(self, values, ids, domain):
+        '''
+        Return the checkpoint of the run of values on ids or domain, which is
+        not saved if the run was not interrupted, and remove the checkpoints
+        of the other runs.
+        '''
+        pool = Pool()
+        Checkpoint = pool.get('mass.editing.checkpoint')
+        key = self._run_key(values, ids, domain)
+        checkpoints = Checkpoint.search([
+                ('mass_edit', '=', self.id),
+                ])
+        current = [c for c in checkpoints if c.key == key]
+        Checkpoint.delete([c for c in checkpoints if c.key != key])
+        if current:
+            return current[0]
+        return Checkpoint(mass_edit=self, key=key, summary=summarize(values),
+            checkpoint=None)
+
+    @without_check_access
+    def _end_run(self, run):
+        run.__class__.delete([run])
+        if self.commit_chunks:
+            Transaction().commit()
+
+    @classmethod
+    def _get_xxx2many_relation(cls, EditingModel, name):
+        '''
+        Return the table storing the xxx2many field name as a tuple with the
+        origin column, its type, the target column and the where clause.
+        Return None if the field is not stored in a table.
+        '''
+        pool = Pool()
+        transaction = Transaction()
+
+        field = EditingModel._fields[name]
+        if isinstance(field, fields.Function):
+            return
+
+        where = Literal(True)
+        if isinstance(field, fields.Many2Many) and not field.filter:
+            Relation = pool.get(field.relation_name)
+            if not cls._is_table(Relation):
+                return
+            table = Relation.__table__()
+            origin_field = Relation._fields[field.origin]
+            origin = Column(table, field.origin)
+            target = Column(table, field.target)
+            where &= target != Null
+        elif isinstance(field, fields.One2Many) and not field.filter:
+            Target = pool.get(field.model_name)
+            if not cls._is_table(Target):
+                return
+            table = Target.__table__()
+            origin_field = Target._fields[field.field]
+            origin = Column(table, field.field)
+            target = table.id
+            active = Target._fields.get('active')
+            if isinstance(active, fields.Function):
+                return
+            elif active and transaction.active_records:
+                where &= table.active == Literal(True)
+        else:
+            return
+        if origin_field._type not in {'many2one', 'reference'}:
+            return
+        return table, origin, origin_field._type, target, where
+
+    @staticmethod
+    def _origin_clause(EditingModel, origin, type_, ids):
+        "Return the clause on the origin column for the records of ids"
+        if type_ == 'reference':
+            ids = ['%s,%s' % (EditingModel.__name__, i) for i in ids]
+        return fields.SQL_OPERATORS['in'](origin, list(ids))
+
+    @classmethod
+    def _get_xxx2many_ids(cls, EditingModel, name, ids):
+        '''
+        Return the set of target ids linked by the xxx2many field name to the
+        records of ids.
+
+        The ids are read directly from the relation table or the foreign key
+        of the target table when possible, otherwise they are read by the ORM.
+        '''
+        cursor = Transaction().connection.cursor()
+        in_max = backend.MAX_QUERY_PARAMS
+
+        xxx2m_ids = set()
+        relation = cls._get_xxx2many_relation(EditingModel, name)
+        if relation is None:
+            for sub_ids in grouped_slice(ids, in_max):
+                for values in EditingModel.read(list(sub_ids), [name]):
+                    xxx2m_ids.update(values[name] or [])
+            return xxx2m_ids
+
+        table, origin, type_, target, where = relation
+        for sub_ids in grouped_slice(ids, in_max):
+            clause = cls._origin_clause(EditingModel, origin, type_, sub_ids)
+            cursor.execute(*table.select(target, where=clause & where))
+            xxx2m_ids.update(i for i, in cursor)
+        return xxx2m_ids
+
+    @classmethod
+    def _count_xxx2many(cls, EditingModel, name, ids):
+        "Return the number of rows linking the records of ids to field name"
+        cursor = Transaction().connection.cursor()
+        relation = cls._get_xxx2many_relation(EditingModel, name)
+        if relation is None:
+            return len(cls._get_xxx2many_ids(EditingModel, name, ids))
+
+        count = 0
+        table, origin, type_, target, where = relation
+        for sub_ids in grouped_slice(ids, backend.MAX_QUERY_PARAMS):
+            clause = cls._origin_clause(EditingModel, origin, type_, sub_ids)
+            cursor.execute(*table.select(Count(Literal('*')),
+                    where=clause & where))
+            count += cursor.fetchone()[0]
+        return count
+
+    @classmethod
+    def _merge_dict(cls, EditingModel, name, ids, value):
+        '''
+        Merge value into the dict field name of the records of ids.
+
+        The keys set to None are removed, as _filter_unchanged expects.
+        On PostgreSQL a plain stored column is merged with a single UPDATE,
+        otherwise the records are grouped by their resulting value and
+        written together.
+        '''
+        field = EditingModel._fields[name]
+        removed = [k for k, v in value.items() if v is None]
+        if (backend.name == 'postgresql'
+                and cls._is_sql_safe(EditingModel, [name])):
+            table = EditingModel.__table__()
+            column = Column(table, name)
+            merged = Cast(Coalesce(column, '{}'), 'JSONB')
+            if removed:
+                merged = Sub(merged, Cast(Literal(removed), 'TEXT[]'))
+            kept = {k: v for k, v in value.items() if v is not None}
+            merged = Concat(merged, Cast(
+                    Literal(field.sql_format(kept)), 'JSONB'))
+            cls._sql_update(EditingModel, table, ids, [column], [merged])
+            return
+
+        groups = {}
+        for sub_ids in grouped_slice(ids, backend.MAX_QUERY_PARAMS):
+            for values in EditingModel.read(list(sub_ids), [name]):
+                new_value = cls._merged(values[name], value)
+                key = json.dumps(new_value, cls=JSONEncoder, sort_keys=True)
+                groups.setdefault(key, (new_value, []))[1].append(
+                    values['id'])
+        to_write = []
+        for new_value, record_ids in groups.values():
+            to_write.extend([EditingModel.browse(record_ids),
+                    {name: new_value}])
+        if to_write:
+            EditingModel.write(*to_write)
+
+    @staticmethod
+    def _merged(current, value):
+        "Return current updated by value without the keys set to None"
+        merged = dict(current or {})
+        for key, key_value in (value or {}).items():
+            if key_value is None:
+                merged.pop(key, None)
+            else:
+                merged[key] = key_value
+        return merged
+
+    @classmethod
+    def _is_sql_safe(cls, EditingModel, names, values=None):
+        '''
+        Return if the fields names can be updated by SQL without skipping any
+        business logic of the ORM.
+
+        When values is given, the values of the fields are also checked
+        against the constraints of the fields which are validated in Python.
+        '''
+        pool = Pool()
+        Trigger = pool.get('ir.trigger')
+        if not cls._is_table(EditingModel):
+            return False
+        for name in names:
+            field = EditingModel._fields.get(name)
+            if (field is None
+                    or isinstance(field, fields.Function)
+                    or hasattr(field, 'set')
+                    or getattr(field, 'translate', False)
+                    or field.validation_depends
+                    or name in EditingModel._path_fields
+                    or name in EditingModel._mptt_fields):
+                return False
+            if values is not None:
+                value = values[name]
+                if (field.domain
+                        or 'required' in field.states
+                        or getattr(field, 'size', None)
+                        or (field.required and value in {None, ''})):
+                    return False
+                if isinstance(field, fields.Selection):
+                    if (not isinstance(field.selection, (list, tuple))
+                            or value not in dict(field.selection)):
+                        return False
+                digits = getattr(field, 'digits', None)
+                if digits is not None and value is not None:
+                    if (not isinstance(digits, tuple)
+                            or (digits[1] is not None
+                                and round(value, digits[1]) != value)):
+                        return False
+        for Model in EditingModel.__mro__:
+            if (Model.__module__.startswith('trytond.model')
+                    or Model in {ComputeFieldsMixin, ValidateMixin}):
+                continue
+            if _WRITE_HOOKS & vars(Model).keys():
+                return False
+        with without_check_access():
+            if Trigger.get_triggers(EditingModel.__name__, 'write'):
+                return False
+        return True
+
+    @classmethod
+    def _sql_update(cls, EditingModel, table, ids, columns, values):
+        '''
+        Update the columns of the records of ids with a single query by slice
+        and maintain the write fields, the history and the caches.
+
+        The access and the record rules are checked like a write.
+        '''
+        pool = Pool()
+        ModelAccess = pool.get('ir.model.access')
+        ModelFieldAccess = pool.get('ir.model.field.access')
+        transaction = Transaction()
+        cursor = transaction.connection.cursor()
+
+        ModelAccess.check(EditingModel.__name__, 'write')
+        ModelFieldAccess.check(EditingModel.__name__,
+            [c.name for c in columns], 'write')
+        cls._check_write_rule(EditingModel, ids)
+
+        columns = list(columns) + [table.write_uid, table.write_date]
+        values = list(values) + [transaction.user, CurrentTimestamp()]
+        for sub_ids in grouped_slice(ids, backend.MAX_QUERY_PARAMS):
+            cursor.execute(*table.update(columns, values,
+                    where=fields.SQL_OPERATORS['in'](
+                        table.id, list(sub_ids))))
+        EditingModel._insert_history(ids)
+
+        transaction.counter += 1
+        for cache in transaction.cache.values():
+            cache_cls = cache.get(EditingModel.__name__)
+            if cache_cls is not None:
+                for id_ in ids:
+                    cache_cls.pop(id_, None)
+
+    @classmethod
+    def _write_computed(cls, EditingModel, ids, expressions, plan):
+        '''
+        Write on the records of ids the values computed by the expressions
+        from their values before the edit.
+
+        The fields enabled for direct SQL are updated by a single query, the
+        others are evaluated by slice and the records sharing the same values
+        are written together.
+        '''
+        sql_names = [n for n, e in expressions.items()
+            if plan[n].sql and e.is_sql(n)]
+        if not cls._is_sql_safe(EditingModel, sql_names):
+            sql_names = []
+        names = [n for n in expressions if n not in sql_names]
+
+        groups = {}
+        if names:
+            read_names = set().union(*(expressions[n].names for n in names))
+            for sub_ids in grouped_slice(ids, backend.MAX_QUERY_PARAMS):
+                for record in EditingModel.read(
+                        list(sub_ids), list(read_names)):
+                    key = tuple(expressions[n].evaluate(record, n)
+                        for n in names)
+                    groups.setdefault(key, []).append(record['id'])
+        if sql_names:
+            table = EditingModel.__table__()
+            with phase('sql', len(ids)):
+                cls._sql_update(EditingModel, table, ids,
+                    [Column(table, n) for n in sql_names],
+                    [expressions[n].as_sql(table, n) for n in sql_names])
+        to_write = []
+        for key, record_ids in groups.items():
+            to_write.extend([
+                    EditingModel.browse(record_ids),
+                    dict(zip(names, key)),
+                    ])
+        if to_write:
+            EditingModel.write(*to_write)
+
+    @staticmethod
+    def _is_table(Model):
+        "Return if the records of Model are stored on its own SQL table"
+        return (issubclass(Model, ModelSQL)
+            and not callable(getattr(Model, 'table_query', None)))
+
+    @classmethod
+    def _execute_chunk(cls, EditingModel, ids, vals, plan):
+        res, sql_res, expressions, creates = {}, {}, {}, {}
+        for key, value in vals.items():
+            if not key.startswith('selection_'):
+                continue
+            name = key.split('_', 1)[1]
+            field = plan[name]
+            if value == 'set':
+                if field.xxx2many:
+                    to_set = []
+                    to_create = []
+                    for val in vals.get(name) or []:
+                        if isinstance(val, dict):
+                            to_create.append(field.target_values(val))
+                        else:
+                            to_set.append(val)
+                    to_write = []
+                    if to_set:
+                        with phase('diff', len(ids)):
+                            xxx2m_ids = cls._get_xxx2many_ids(
+                                EditingModel, name, ids)
+                        xxx2m_ids = list(xxx2m_ids - set(to_set))
+                        to_write.append(('remove', xxx2m_ids))
+                        to_write.append(('add', to_set))
+                    if to_create and field.one2many and not field.function:
+                        creates[name] = to_create
+                        # Write the records even without other action
+                        res[name] = to_write
+                    elif to_create:
+                        to_write.append(('create', to_create),)
+                    if to_write:
+                        res[name] = to_write
+                elif field.dict:
+                    with phase('dict', len(ids)):
+                        cls._merge_dict(EditingModel, name, ids,
+                            vals.get(name) or {})
+                elif field.sql:
+                    sql_res[name] = vals.get(name, None)
+                else:
+                    res[name] = vals.get(name, None)
+            elif value == 'remove':
+                if field.xxx2many:
+                    res[name] = [('remove', vals.get(name, []))]
+                elif field.sql:
+                    sql_res[name] = None
+                else:
+                    res[name] = None
+            elif value == 'remove_all':
+                with phase('diff', len(ids)):
+                    xxx2m_ids = cls._get_xxx2many_ids(EditingModel, name, ids)
+                res[name] = [
+                    ('delete' if field.one2many else 'remove',
+                        list(xxx2m_ids))]
+            elif value == 'add':
+                res[name] = [('add', vals.get(name, []))]
+            elif value == 'compute':
+                expressions[name] = Expression(EditingModel,
+                    vals.get('expression_%s' % name) or '')
+        if expressions:
+            with phase('compute', len(ids)):
+                cls._write_computed(EditingModel, ids, expressions, plan)
+        if sql_res:
+            if cls._is_sql_safe(EditingModel, sql_res, sql_res):
+                table = EditingModel.__table__()
+                with phase('sql', len(ids)):
+                    cls._sql_update(EditingModel, table, ids,
+                        [Column(table, n) for n in sql_res],
+                        [EditingModel._fields[n].sql_format(v)
+                            for n, v in sql_res.items()])
+            else:
+                res.update(sql_res)
+        for name, templates in creates.items():
+            with phase('create', len(ids) * len(templates)):
+                cls._create_one2many(EditingModel, name, ids, templates)
+        if res:
+            instances = EditingModel.browse(ids)
+            try:
+                EditingModel.write(instances, res)
+            except NotImplementedError as e:
+                raise UserError(str(e))
+
+    @classmethod
+    def _create_one2many(cls, EditingModel, name, ids, templates):
+        '''
+        Create the lines of the templates for each record of ids with a
+        single create.
+
+        The templates are completed with the default values once instead of
+        for each line.
+        '''
+        field = EditingModel._fields[name]
+        Target = field.get_target()
+        reverse = Target._fields[field.field]
+        lines = []
+        for template in templates:
+            names = [n for n, f in Target._fields.items()
+                if n not in template
+                and n != field.field
+                and n not in _LOG_FIELDS
+                and (not isinstance(f, fields.Function) or f.setter)]
+            values = Target._clean_defaults(
+                Target.default_get(names, with_rec_name=False))
+            values.update(template)
+            lines.append(values)
+        to_create = []
+        for record_id in ids:
+            if reverse._type == 'reference':
+                record_id = '%s,%s' % (EditingModel.__name__, record_id)
+            to_create.extend({**v, field.field: record_id} for v in lines)
+        if to_create:
+            Target.create(to_create)
+
 
 class MassEditFields(ModelSQL):
     'Mass Edit Fields'
@@ -115,6 +1553,13 @@ class MassEditFields(ModelSQL):
         for _field in fields:
             _field.check_field()
 
+    @classmethod
+    def on_modification(cls, mode, records, field_names=None):
+        pool = Pool()
+        MassEditWizardStart = pool.get('mass.editing.wizard.start')
+        super().on_modification(mode, records, field_names=field_names)
+        MassEditWizardStart._view_cache.clear()
+
     def check_field(self):
         Model = Pool().get(self.field.model)
 
@@ -124,16 +1569,57 @@ class MassEditFields(ModelSQL):
                     'msg_error_setter', name=self.field.rec_name,))
 
 
+class MassEditSQLFields(ModelSQL):
+    'Mass Edit Direct SQL Fields'
+    __name__ = 'mass.editing.sql-ir.model.field'
+
+    mass_edit = fields.Many2One('mass.editing', 'Mass', required=True,
+        ondelete='CASCADE')
+    field = fields.Many2One('ir.model.field', 'Field', required=True,
+        ondelete='CASCADE')
+
+    @classmethod
+    def on_modification(cls, mode, records, field_names=None):
+        pool = Pool()
+        MassEdit = pool.get('mass.editing')
+        super().on_modification(mode, records, field_names=field_names)
+        MassEdit._plan_cache.clear()
+
+
+class MassEditCheckpoint(ModelSQL, ModelView):
+    'Mass Edit Checkpoint'
+    __name__ = 'mass.editing.checkpoint'
+    mass_edit = fields.Many2One('mass.editing', 'Mass Edit', required=True,
+        readonly=True, ondelete='CASCADE')
+    key = fields.Char('Key', required=True, readonly=True,
+        help='The digest of the values and the records of the execution.')
+    summary = fields.Text('Summary', readonly=True)
+    checkpoint = fields.Integer('Checkpoint', readonly=True,
+        help='The last record processed.')
+
+
 class MassEditWizardStart(ModelView):
     'Mass Edit Wizard Start'
     __name__ = 'mass.editing.wizard.start'
+    _view_cache = Cache('mass_editing.wizard_view', context=False)
 
     @classmethod
     def __setup__(cls):
         super(MassEditWizardStart, cls).__setup__()
+        # The fields of the view are not fields of the model to instantiate
+        cls.__rpc__['on_change'] = RPC()
 
     @classmethod
     def fields_view_get(cls, view_id=None, view_type='form', level=None):
+        with Metrics('mass_editing.fields_view_get') as metrics:
+            res = cls._get_mass_view(view_id, view_type, level)
+        metrics.log(logging.DEBUG,
+            model=Transaction().context.get('active_model'),
+            view_type=view_type)
+        return res
+
+    @classmethod
+    def _get_mass_view(cls, view_id, view_type, level):
         class Decoder(json.JSONDecoder):
 
             def __init__(self, context=None):
@@ -148,9 +1634,7 @@ class MassEditWizardStart(ModelView):
         pool = Pool()
         MassEdit = pool.get('mass.editing')
         Field = pool.get('ir.model.field')
-
-        # sure clear view cache
-        cls._fields_view_get_cache.clear()
+        User = pool.get('res.user')
 
         res = super().fields_view_get(view_id,
             view_type, level)
@@ -171,6 +1655,18 @@ class MassEditWizardStart(ModelView):
         if not edits:
             return res
         edit, = edits
+
+        # The fields picked on the wizard when there are many
+        picked = context.get('mass_editing_fields')
+        if picked is not None:
+            picked = tuple(sorted(picked))
+        key = (model, edit.id, edit.write_date or edit.create_date,
+            Transaction().language, User.get_groups(), view_id, level,
+            picked)
+        with phase('cache'):
+            cached = cls._view_cache.get(key)
+        if cached is not None:
+            return cached
         fields = dict(res['fields'])
         root = etree.fromstring(res['arch'])
         # Iterate on all root children and remove them except for the tag
@@ -181,9 +1677,14 @@ class MassEditWizardStart(ModelView):
             root.remove(child)
 
         form = root.find('separator').getparent()
+        # Index the widgets once instead of searching the tree for each field
+        widgets = {(e.tag, e.get('name') or e.get('id'))
+            for e in root.iter('label', 'field')}
         Model = pool.get(edit.model.name)
 
         model_fields = edit.model_fields
+        if picked is not None:
+            model_fields = tuple(f for f in model_fields if f.name in picked)
         company_field = None
         if hasattr(Model, 'company'):
             if not [f for f in edit.model_fields
@@ -195,7 +1696,9 @@ class MassEditWizardStart(ModelView):
                     model_fields = model_fields + (company_field[0],)
 
         model_field_names = [f.name for f in model_fields]
-        for k, v in EditingModel.fields_get(model_field_names).items():
+        with phase('fields_get', len(model_field_names)):
+            fields_get = EditingModel.fields_get(model_field_names)
+        for k, v in fields_get.items():
             # Ensure field_name key from fields_get is requested in edit.model_fields
             if k in model_field_names:
                 fields[k] = v
@@ -274,6 +1777,20 @@ class MassEditWizardStart(ModelView):
                     ('set', 'Set'),
                     ('remove', 'Remove')
                     ]
+            if field.ttype in EXPRESSION_TYPES:
+                selection_vals.append(('compute', 'Compute'))
+                fields['expression_%s' % field.name] = {
+                    'name': 'expression_%s' % field.name,
+                    'type': 'char',
+                    'string': gettext('mass_editing.msg_expression'),
+                    'help': gettext('mass_editing.msg_expression_help'),
+                    'states': PYSONEncoder().encode({
+                            'invisible': (
+                                Eval('selection_%s' % field.name)
+                                != 'compute'),
+                            }),
+                    'depends': ['selection_%s' % field.name],
+                    }
             translated_vals = []
             for val in selection_vals:
                 if val[0]:
@@ -292,6 +1809,7 @@ class MassEditWizardStart(ModelView):
                 'string': fields[field.name]['string'],
                 'selection': translated_vals,
                 'help': '',
+                'on_change': ['selection_%s' % field.name, field.name],
                 }
 
             xml_parent = form if not pages else pages[index // PAGE_FIELDS]
@@ -309,43 +1827,157 @@ class MassEditWizardStart(ModelView):
                     })
                 continue
 
-            to_find = ".//label[@id='label_%s']" % field.name
-            if root.find(to_find) is None:
+            if ('label', 'label_%s' % field.name) not in widgets:
                 etree.SubElement(xml_group, 'label', {
                         'id': "label_%s" % field.name,
                         'string': fields[field.name]['string'],
                         'xalign': '0.0',
                         'colspan': '4',
                         })
-            to_find = ".//field[@name='selection_%s']" % field.name
-            if root.find(to_find) is None:
+            for name in ['selection_%s' % field.name, field.name]:
+                if ('field', name) not in widgets:
+                    etree.SubElement(xml_group, 'field', {
+                            'name': name,
+                            'colspan': colspan,
+                            })
+            widgets.update([
+                    ('label', 'label_%s' % field.name),
+                    ('field', 'selection_%s' % field.name),
+                    ('field', field.name),
+                    ])
+            if 'expression_%s' % field.name in fields:
                 etree.SubElement(xml_group, 'field', {
-                        'name': "selection_%s" % field.name,
-                        'colspan': colspan,
-                        })
-            to_find = ".//field[@name='%s']" % field.name
-            if root.find(to_find) is None:
-                etree.SubElement(xml_group, 'field', {
-                        'name': field.name,
-                        'colspan': colspan,
+                        'name': 'expression_%s' % field.name,
+                        'colspan': '2',
                         })
 
         res['arch'] = etree.tostring(root).decode('utf-8')
         res['fields'] = fields
-        return res
+        return cls._view_cache.set(key, res)
 
     @classmethod
     def default_get(cls, fields, with_rec_name=True, with_default=True):
+        '''
+        Return the operations and the values of the context.
+
+        The default values of the edited fields are not computed until their
+        operation is switched to set (see on_change) but the other fields,
+        like the company, get their default value.
+        '''
         pool = Pool()
         context = Transaction().context
-        res = dict.fromkeys([f for f in fields if f[:10] == 'selection_'], '')
+        res = {f: context.get('default_%s' % f, '') for f in fields
+            if f.startswith(('selection_', 'expression_'))}
         model = context.get('active_model')
         if model:
             EditingModel = pool.get(model)
             res.update(EditingModel.default_get([f for f in fields
-                        if f[:10] != 'selection_'], with_rec_name, with_default))
+                        if f not in res
+                        and ('selection_%s' % f not in res
+                            or 'default_%s' % f in context)],
+                    with_rec_name, with_default))
         return res
 
+    @classmethod
+    def on_change(cls, values, fieldnames):
+        '''
+        Return the default values of the empty fields whose operation is
+        switched to set.
+        '''
+        pool = Pool()
+        model = Transaction().context.get('active_model')
+        if not model:
+            return {}
+        EditingModel = pool.get(model)
+        names = []
+        for fieldname in fieldnames:
+            if not fieldname.startswith('selection_'):
+                continue
+            name = fieldname[len('selection_'):]
+            field = EditingModel._fields.get(name)
+            # The client expects changes of the lines for the xxx2many
+            if (values.get(fieldname) == 'set'
+                    and field is not None
+                    and field._type not in {'one2many', 'many2many'}
+                    and values.get(name) in {None, ''}):
+                names.append(name)
+        if not names:
+            return {}
+        return EditingModel.default_get(names)
+
+
+class MassEditWizardPick(ModelView):
+    'Mass Edit Wizard Pick'
+    __name__ = 'mass.editing.wizard.pick'
+    field_names = fields.MultiSelection('get_field_names', 'Fields',
+        required=True, help='The fields to edit.')
+
+    @classmethod
+    def get_field_names(cls):
+        "Return the fields of the mass edit of the active model"
+        pool = Pool()
+        MassEdit = pool.get('mass.editing')
+        model = Transaction().context.get('active_model')
+        if not model:
+            return []
+        edits = MassEdit.search([('model.name', '=', model)], limit=1)
+        if not edits:
+            return []
+        edit, = edits
+        return [(f.name, f.string) for f in edit.model_fields]
+
+
+class MassEditWizardPreview(ModelView):
+    'Mass Edit Wizard Preview'
+    __name__ = 'mass.editing.wizard.preview'
+    total = fields.Integer('Records', readonly=True)
+    to_change = fields.Integer('To Change', readonly=True)
+    unchanged = fields.Integer('Unchanged', readonly=True,
+        help='The records which already hold the values.')
+    related = fields.Integer('Related Rows Removed', readonly=True,
+        help='The related rows removed by the "Remove All" operations.')
+    sample = fields.Text('Sample', readonly=True)
+    skip_unchanged = fields.Boolean('Skip Unchanged',
+        help='Do not write the records which already hold the values.')
+    values = fields.Dict(None, 'Values', readonly=True)
+
+
+class MassEditWizardPreset(ModelView):
+    'Mass Edit Wizard Preset'
+    __name__ = 'mass.editing.wizard.preset'
+    name = fields.Char('Name', required=True)
+    domain = fields.Char('Domain',
+        help='The PYSON encoded domain of the records to update.')
+    incremental = fields.Boolean('Changed Records Only',
+        help='Update only the records created or modified since the last '
+        'run.')
+    values = fields.Dict(None, 'Values', readonly=True)
+
+
+class MassEditWizardDone(ModelView):
+    'Mass Edit Wizard Done'
+    __name__ = 'mass.editing.wizard.done'
+    written = fields.Integer('Records Updated', readonly=True)
+    skipped = fields.Integer('Records Skipped', readonly=True,
+        help='The records which already held the values.')
+    failed = fields.Text('Records Not Updated', readonly=True,
+        states={
+            'invisible': ~Eval('failed'),
+            },
+        help='The ids of the records locked by other users.')
+
+
+class PickedStateView(StateView):
+    "A state view showing only the fields picked on the pick state"
+
+    def get_view(self, wizard, state_name):
+        names = getattr(wizard.pick, 'field_names', None)
+        context = {}
+        if names:
+            context['mass_editing_fields'] = list(names)
+        with Transaction().set_context(context):
+            return super().get_view(wizard, state_name)
+
 
 class CustomDict(dict):
 
@@ -359,13 +1991,45 @@ class CustomDict(dict):
 class MassEditingWizard(Wizard):
     'Mass Edit Wizard'
     __name__ = 'mass.editing.wizard'
-    start = StateView('mass.editing.wizard.start',
+    start_state = 'choose'
+    choose = StateTransition()
+    pick = StateView('mass.editing.wizard.pick',
+        'mass_editing.view_mass_editing_wizard_pick', [
+            Button('Cancel', 'end', 'tryton-cancel'),
+            Button('Next', 'start', 'tryton-forward', True),
+            ])
+    start = PickedStateView('mass.editing.wizard.start',
           'mass_editing.view_mass_editing_wizard_start', [
                 Button('Cancel', 'end', 'tryton-cancel'),
+                Button('Save as Preset', 'preset', 'tryton-save', states={
+                        # Only the administrators can create presets
+                        'invisible': ~Id('res', 'group_admin').in_(
+                            Eval('context', {}).get('groups', [])),
+                        }),
+                Button('Preview', 'preview', 'tryton-search'),
+                Button('Apply in Background', 'background', 'tryton-launch'),
                 Button('Apply', 'update', 'tryton-ok', True),
                 ])
+    preview = StateView('mass.editing.wizard.preview',
+        'mass_editing.view_mass_editing_wizard_preview', [
+            Button('Back', 'start', 'tryton-back'),
+            Button('Apply in Background', 'background', 'tryton-launch'),
+            Button('Apply', 'update', 'tryton-ok', True),
+            ])
+
+    preset = StateView('mass.editing.wizard.preset',
+        'mass_editing.view_mass_editing_wizard_preset', [
+            Button('Cancel', 'end', 'tryton-cancel'),
+            Button('Save', 'save_preset', 'tryton-ok', True),
+            ])
+    save_preset = StateTransition()
 
     update = StateTransition()
+    background = StateTransition()
+    done = StateView('mass.editing.wizard.done',
+        'mass_editing.view_mass_editing_wizard_done', [
+            Button('Close', 'end', 'tryton-close', True),
+            ])
 
     def __getattribute__(self, name):
         if name == 'start':
@@ -374,115 +2038,126 @@ class MassEditingWizard(Wizard):
             name = 'start_data'
         return super(MassEditingWizard, self).__getattribute__(name)
 
+    def transition_choose(self):
+        '''
+        Let the user pick the fields to edit when they do not fit on a single
+        page, so the form is built only for them.
+        '''
+        pool = Pool()
+        MassEdit = pool.get('mass.editing')
+        context = Transaction().context
+
+        edits = MassEdit.search(
+            [('model.name', '=', context.get('active_model'))], limit=1)
+        if edits:
+            edit, = edits
+            if len(edit.model_fields) > PAGE_FIELDS:
+                return 'pick'
+        return 'start'
+
+    def default_start(self, fields):
+        # Restore the values when going back from the preview
+        return dict(self.preview.values or {})
+
+    def default_preview(self, fields):
+        pool = Pool()
+        MassEdit = pool.get('mass.editing')
+        context = Transaction().context
+
+        values = dict(self.start)
+        edits = MassEdit.search(
+            [('model.name', '=', context.get('active_model'))], limit=1)
+        if not edits:
+            return {}
+        edit, = edits
+        res = edit.preview(values, **self.get_target())
+        res['to_change'] = res['total'] - res['unchanged']
+        res['values'] = values
+        res['skip_unchanged'] = True
+        return res
+
+    def default_preset(self, fields):
+        target = self.get_target()
+        if 'domain' in target:
+            domain = target['domain']
+        else:
+            domain = [('id', 'in', target['ids'])]
+        return {
+            'domain': PYSONEncoder().encode(domain),
+            'incremental': False,
+            'values': dict(self.start),
+            }
+
+    def transition_save_preset(self):
+        pool = Pool()
+        MassEdit = pool.get('mass.editing')
+        Preset = pool.get('mass.editing.preset')
+        context = Transaction().context
+
+        edits = MassEdit.search(
+            [('model.name', '=', context.get('active_model'))], limit=1)
+        if edits:
+            edit, = edits
+            Preset.create([{
+                        'mass_edit': edit.id,
+                        'name': self.preset.name,
+                        'domain': self.preset.domain,
+                        'incremental': self.preset.incremental,
+                        'values': self.preset.values,
+                        }])
+        return 'end'
+
+    def get_values(self):
+        "Return the values and options filled on the wizard"
+        if self.start:
+            return dict(self.start), {}
+        return dict(self.preview.values or {}), {
+            'skip_unchanged': bool(self.preview.skip_unchanged),
+            }
+
     def transition_update(self):
         pool = Pool()
+        MassEdit = pool.get('mass.editing')
         context = Transaction().context
 
-        res = {}
         model = context.get('active_model')
         if not model:
             return 'end'
-        EditingModel = pool.get(model)
-        vals = self.start_data
-        for field, value in vals.items():
-            if field.startswith('selection_'):
-                split_key = field.split('_', 1)[1]
-                _field = getattr(EditingModel, split_key, None)
-                xxx2many = False
-                one2many = False
-                dik = False
-                if isinstance(_field, fields.Function) and _field.setter:
-                    _field = _field._field  # Use original field
-                if (isinstance(_field, fields.One2Many)
-                        or isinstance(_field, fields.Many2Many)):
-                    xxx2many = True
-                if (isinstance(_field, fields.Dict)):
-                    dik = True
-
-                if isinstance(_field, fields.One2Many):
-                    one2many = True
-                if value == 'set':
-                    if xxx2many:
-                        manyvals = vals.get(split_key, None)
-                        to_set = []
-                        to_create = []
-                        for val in manyvals:
-                            if isinstance(val, dict):
-                                # check_xxx2many
-                                TargetModel = pool.get(_field.model_name)
-
-                                new_val = val.copy()
-                                for field_name, field_value in val.items():
-                                    if isinstance(field_value, list):
-                                        new_val[field_name] = [tuple(['add',
-                                                field_value])]
-                                    target_field = TargetModel._fields[
-                                        field_name]
-                                    if (isinstance(
-                                                target_field, fields.Function)
-                                            and not target_field.setter):
-                                        del new_val[field_name]
-
-                                to_create.append(new_val)
-                            else:
-                                to_set.append(val)
-                        to_write = []
-                        if to_set:
-                            xxx2m_ids = set()
-                            records = EditingModel.search([
-                                ('id', 'in',
-                                    Transaction().context.get('active_ids')),
-                                ])
-                            for record in records:
-                                xxx2m_ids |= set([r.id for r in getattr(
-                                    record, _field.name)])
-                            xxx2m_ids = list(
-                                xxx2m_ids - set(to_set) - set(to_create))
-                            to_write.append(('remove', xxx2m_ids))
-                            to_write.append(('add', to_set))
-                        if to_create:
-                            to_write.append(('create', to_create),)
-                        if to_write:
-                            res.update({split_key: to_write})
-                    else:
-                        if not dik:
-                            res.update({split_key: vals.get(split_key, None)})
-                        else:
-                            records = EditingModel.browse(Transaction().context.get('active_ids'))
-                            for record in records:
-                                val = dict(getattr(record, split_key) or {})
-                                val.update(vals.get(split_key))
-                                setattr(
-                                    record,
-                                    split_key,
-                                    val)
-                                record.save()
-
-                elif value == 'remove':
-                    if xxx2many:
-                        res.update({split_key: [
-                                    ("remove", vals.get(split_key, []))
-                                    ]})
-                    else:
-                        res.update({split_key: None})
-                elif value == 'remove_all':
-                    xxx2m_ids = set()
-                    records = EditingModel.search([
-                        ('id', 'in', Transaction().context.get('active_ids'))])
-                    for record in records:
-                        xxx2m_ids |= set([r.id for r in getattr(
-                            record, _field.name)])
-                    res.update({split_key: [
-                                ('delete' if one2many else 'remove',
-                                    list(xxx2m_ids))]})
-                elif value == 'add':
-                    res.update({split_key: [('add', vals.get(split_key, []))]})
-        if res:
-            instances = EditingModel.browse(Transaction().context.get(
-                    'active_ids'))
-            try:
-                EditingModel.write(instances, res)
-            except NotImplementedError as e:
-                raise UserError(str(e))
+        values, options = self.get_values()
+        self.result = MassEdit.apply(
+            model, values, **options, **self.get_target())
+        if not self.result:
+            return 'end'
+        return 'done'
 
+    def default_done(self, fields):
+        return {
+            'written': self.result['written'],
+            'skipped': self.result['skipped'],
+            'failed': ', '.join(map(str, self.result['failed'])),
+            }
+
+    def transition_background(self):
+        pool = Pool()
+        MassEdit = pool.get('mass.editing')
+        context = Transaction().context
+
+        model = context.get('active_model')
+        if not model:
+            return 'end'
+        values, options = self.get_values()
+        MassEdit.apply(model, values, background=True, **options,
+            **self.get_target())
         return 'end'
+
+    def get_target(self):
+        '''
+        Return the ids or the domain of the records to update.
+
+        The active_domain key of the context, when set, replaces active_ids.
+        '''
+        context = Transaction().context
+        domain = context.get('active_domain')
+        if domain is not None:
+            return {'domain': domain}
+        return {'ids': context.get('active_ids') or []}
@@ -0,0 +1,152 @@
+# The COPYRIGHT file at the top level of this repository contains the full
+# copyright notices and license terms.
+import datetime
+import logging
+
+from sql import Select
+from sql.functions import CurrentTimestamp
+
+from trytond.transaction import Transaction
+from trytond.model import ModelView, ModelSQL, DeactivableMixin, fields
+from trytond.pool import PoolMeta
+from trytond.pyson import Bool, Eval, PYSONDecoder
+from trytond.i18n import gettext
+from trytond.model.exceptions import ValidationError
+
+from .job import summarize
+
+logger = logging.getLogger(__name__)
+
+
+class MassEditPreset(DeactivableMixin, ModelSQL, ModelView):
+    'Mass Edit Preset'
+    __name__ = 'mass.editing.preset'
+    mass_edit = fields.Many2One('mass.editing', 'Mass Edit', required=True,
+        ondelete='CASCADE')
+    name = fields.Char('Name', required=True)
+    values = fields.Dict(None, 'Values', readonly=True)
+    domain = fields.Char('Domain',
+        help='The PYSON encoded domain of the records to update.')
+    skip_unchanged = fields.Boolean('Skip Unchanged',
+        help='Do not write the records which already hold the values.')
+    incremental = fields.Boolean('Changed Records Only',
+        help='Update only the records created or modified since the last '
+        'run.\n'
+        'The records written by a run are matched again by the next one, so '
+        'the operations must give the same result when applied twice.')
+    last_run = fields.Timestamp('Last Run', readonly=True,
+        states={
+            'invisible': ~Eval('incremental'),
+            },
+        help='The records modified before this time are not updated.')
+    summary = fields.Function(fields.Text('Summary'), 'get_summary')
+
+    @classmethod
+    def __setup__(cls):
+        super(MassEditPreset, cls).__setup__()
+        cls._order.insert(0, ('name', 'ASC'))
+        cls._buttons.update({
+                'run': {
+                    'invisible': ~Eval('active', True),
+                    'depends': ['active'],
+                    },
+                'reset_last_run': {
+                    'invisible': ~Bool(Eval('last_run')),
+                    'depends': ['last_run'],
+                    },
+                })
+
+    @staticmethod
+    def default_skip_unchanged():
+        return True
+
+    @staticmethod
+    def default_incremental():
+        return False
+
+    def get_summary(self, name):
+        return summarize(self.values)
+
+    @classmethod
+    def validate(cls, presets):
+        super(MassEditPreset, cls).validate(presets)
+        for preset in presets:
+            if preset.domain:
+                try:
+                    PYSONDecoder().decode(preset.domain)
+                except Exception:
+                    raise ValidationError(gettext(
+                            'mass_editing.msg_preset_invalid_domain',
+                            preset=preset.rec_name))
+            if preset.incremental and 'compute' in (
+                    preset.values or {}).values():
+                raise ValidationError(gettext(
+                        'mass_editing.msg_preset_incremental_compute',
+                        preset=preset.rec_name))
+
+    @property
+    def target_domain(self):
+        "The domain of the records to update since the last run"
+        domain = PYSONDecoder().decode(self.domain) if self.domain else []
+        if self.incremental and self.last_run:
+            domain = [domain, ['OR',
+                    ('create_date', '>=', self.last_run),
+                    ('write_date', '>=', self.last_run),
+                    ]]
+        return domain
+
+    @classmethod
+    @ModelView.button
+    def run(cls, presets):
+        for preset in presets:
+            preset.execute()
+
+    def execute(self):
+        '''
+        Apply the values of the preset to the records of its domain and
+        return the result of the mass edit execution.
+
+        The start of the run is stored as the high-water mark of an
+        incremental preset.
+        '''
+        mark = self._now()
+        result = self.mass_edit.execute(None, self.values,
+            domain=self.target_domain, skip_unchanged=self.skip_unchanged)
+        logger.info('Mass edit preset %s: %s', self.id, result)
+        if self.incremental:
+            # The transaction may have been committed by chunks
+            preset = self.__class__(self.id)
+            preset.last_run = mark
+            preset.save()
+        return result
+
+    @classmethod
+    def _now(cls):
+        "Return the timestamp of the database stored on the modified records"
+        cursor = Transaction().connection.cursor()
+        cursor.execute(*Select([CurrentTimestamp()]))
+        now, = cursor.fetchone()
+        if isinstance(now, str):
+            now = datetime.datetime.fromisoformat(now)
+        return now
+
+    @classmethod
+    @ModelView.button
+    def reset_last_run(cls, presets):
+        cls.write(presets, {'last_run': None})
+
+    @classmethod
+    def run_cron(cls):
+        "Run the active presets"
+        presets = cls.search([])
+        cls.run(presets)
+
+
+class Cron(metaclass=PoolMeta):
+    __name__ = 'ir.cron'
+
+    @classmethod
+    def __setup__(cls):
+        super(Cron, cls).__setup__()
+        cls.method.selection.append(
+            ('mass.editing.preset|run_cron', 'Run Mass Edit Presets'))
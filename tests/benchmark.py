@@ -0,0 +1,224 @@
+# This file is part of Tryton.  The COPYRIGHT file at the top level of
+# this repository contains the full copyright notices and license terms.
+"""
+Benchmark of the mass editing wizard on synthetic datasets.
+
+Run it with::
+
+    python -m trytond.modules.mass_editing.tests.benchmark --size 1000
+
+The database is set up like for the tests, so it runs on an in-memory SQLite
+database by default and on PostgreSQL when TRYTOND_DATABASE_URI points to a
+server (see the benchmark-postgresql environment of tox.ini).
+
+For each size it reports the wall time, the number of SQL queries and the
+peak of memory allocated by Python of each step. The memory is traced with
+tracemalloc which slows down the execution, so the times are only comparable
+between runs of the benchmark.
+"""
+import argparse
+import logging
+import time
+import tracemalloc
+
+SIZES = [1000, 10000, 100000]
+CHUNK = 1000
+
+
+class QueryCounter(logging.Handler):
+    "Count the queries logged by the database backends"
+
+    def __init__(self):
+        super().__init__(logging.DEBUG)
+        self.count = 0
+
+    def emit(self, record):
+        self.count += 1
+
+
+counter = QueryCounter()
+for name in [
+        'trytond.backend.sqlite.database',
+        'trytond.backend.postgresql.database',
+        ]:
+    logger = logging.getLogger(name)
+    logger.setLevel(logging.DEBUG)
+    logger.propagate = False
+    logger.addHandler(counter)
+
+# The query logging must be enabled before the connection is opened
+from trytond.tests.test_tryton import (  # noqa: E402
+    activate_module, DB_NAME, USER, CONTEXT)
+from trytond.pool import Pool  # noqa: E402
+from trytond.tools import grouped_slice  # noqa: E402
+from trytond.transaction import Transaction  # noqa: E402
+
+
+def measure(name, size, func):
+    counter.count = 0
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print('%-24s %8d %10.3f %10d %10.1f' % (
+            name, size, elapsed, counter.count, peak / 1024 / 1024))
+    return result
+
+
+def setup_mass_edits():
+    pool = Pool()
+    MassEdit = pool.get('mass.editing')
+    Model = pool.get('ir.model')
+    ModelField = pool.get('ir.model.field')
+
+    mass_edits = {}
+    for model, names in [
+            ('party.party', ['name', 'categories', 'addresses']),
+            ('party.contact_mechanism', ['type']),
+            ('ir.queue', ['data']),
+            ]:
+        mass_edit = MassEdit()
+        mass_edit.model, = Model.search([('name', '=', model)])
+        mass_edit.model_fields = ModelField.search([
+                ('model', '=', model),
+                ('name', 'in', names),
+                ])
+        mass_edit.batch = True
+        mass_edit.chunk_size = CHUNK
+        mass_edit.save()
+        mass_edits[model] = mass_edit
+    return mass_edits
+
+
+def create_parties(size, categories):
+    "Create size parties with two categories, two addresses and a website"
+    pool = Pool()
+    Party = pool.get('party.party')
+
+    party_ids = []
+    for sub_range in grouped_slice(range(size), CHUNK):
+        parties = Party.create([{
+                    'name': 'Party %s' % i,
+                    'categories': [('add', [
+                                categories[i % len(categories)].id,
+                                categories[(i + 1) % len(categories)].id,
+                                ])],
+                    'addresses': [('create', [{}, {}])],
+                    'contact_mechanisms': [('create', [{
+                                    'type': 'other',
+                                    'value': 'party%s.example.com' % i,
+                                    }])],
+                    } for i in sub_range])
+        party_ids.extend(p.id for p in parties)
+    return party_ids
+
+
+def create_tasks(size):
+    pool = Pool()
+    Queue = pool.get('ir.queue')
+
+    task_ids = []
+    for sub_range in grouped_slice(range(size), CHUNK):
+        tasks = Queue.create([{
+                    'name': 'benchmark',
+                    'data': {'index': i, 'parity': i % 2},
+                    } for i in sub_range])
+        task_ids.extend(t.id for t in tasks)
+    return task_ids
+
+
+def update(model, ids, values):
+    "Run the update transition of the wizard"
+    pool = Pool()
+    MassEditingWizard = pool.get('mass.editing.wizard', type='wizard')
+
+    with Transaction().set_context(active_model=model, active_ids=ids):
+        session_id, _, _ = MassEditingWizard.create()
+        wizard = MassEditingWizard(session_id)
+        for name, value in values.items():
+            setattr(wizard.start, name, value)
+        wizard.transition_update()
+        MassEditingWizard.delete(session_id)
+
+
+def run(size):
+    pool = Pool()
+    Category = pool.get('party.category')
+    Mechanism = pool.get('party.contact_mechanism')
+    MassEditWizardStart = pool.get('mass.editing.wizard.start')
+
+    setup_mass_edits()
+    categories = Category.create([{'name': 'C%s' % i} for i in range(10)])
+    category = Category(name='New')
+    category.save()
+
+    party_ids = measure('create parties', size,
+        lambda: create_parties(size, categories))
+    task_ids = measure('create tasks', size, lambda: create_tasks(size))
+    mechanism_ids = [m.id for m in Mechanism.search([
+                ('party', 'in', party_ids),
+                ])]
+
+    with Transaction().set_context(active_model='party.party'):
+        def fields_view_get():
+            MassEditWizardStart._view_cache.clear()
+            MassEditWizardStart.fields_view_get()
+        measure('fields_view_get', size, fields_view_get)
+        measure('fields_view_get cached', size,
+            MassEditWizardStart.fields_view_get)
+        measure('default_get', size,
+            lambda: MassEditWizardStart.default_get(
+                ['selection_name', 'name', 'selection_categories']))
+
+    measure('set', size, lambda: update('party.party', party_ids, {
+                'selection_name': 'set',
+                'name': 'Benchmark',
+                }))
+    measure('set xxx2many', size, lambda: update('party.party', party_ids, {
+                'selection_categories': 'set',
+                'categories': [categories[0].id],
+                }))
+    measure('add', size, lambda: update('party.party', party_ids, {
+                'selection_categories': 'add',
+                'categories': [category.id],
+                }))
+    measure('remove', size, lambda: update('party.party', party_ids, {
+                'selection_categories': 'remove',
+                'categories': [category.id],
+                }))
+    measure('remove_all', size, lambda: update('party.party', party_ids, {
+                'selection_addresses': 'remove_all',
+                }))
+    measure('set selection', size,
+        lambda: update('party.contact_mechanism', mechanism_ids, {
+                'selection_type': 'set',
+                'type': 'website',
+                }))
+    measure('set dict', size, lambda: update('ir.queue', task_ids, {
+                'selection_data': 'set',
+                'data': {'parity': None, 'benchmark': True},
+                }))
+
+
+def main(sizes):
+    activate_module(['mass_editing', 'party'])
+    print('%-24s %8s %10s %10s %10s' % (
+            'step', 'records', 'seconds', 'queries', 'peak MiB'))
+    for size in sizes:
+        with Transaction().start(DB_NAME, USER, context=CONTEXT) \
+                as transaction:
+            try:
+                run(size)
+            finally:
+                transaction.rollback()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('-s', '--size', dest='sizes', type=int,
+        action='append', help='number of records (default: %s)'
+        % ', '.join(map(str, SIZES)))
+    args = parser.parse_args()
+    main(args.sizes or SIZES)
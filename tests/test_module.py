@@ -2,10 +2,21 @@
 # This file is part of Tryton.  The COPYRIGHT file at the top level of
 # this repository contains the full copyright notices and license terms.
 
+import datetime
+import unittest
+from unittest.mock import patch
+
+from sql import For
+
+from trytond import backend
 from trytond.tests.test_tryton import ModuleTestCase, with_transaction
-from trytond.transaction import Transaction
+from trytond.exceptions import UserError
+from trytond.model.exceptions import AccessError
+from trytond.transaction import Transaction, check_access
 from trytond.pool import Pool
 
+from trytond.modules.mass_editing.expression import Expression
+
 
 class MassEditingTestCase(ModuleTestCase):
     'Test MassEditing module'
@@ -58,4 +69,1389 @@ class MassEditingTestCase(ModuleTestCase):
 
         self.assertTrue(len(set([party.name for party in Party.search([])])), 1)
 
+    @with_transaction()
+    def test_mass_editing_view_cache(self):
+        "Test wizard view is cached and invalidated on changes"
+        pool = Pool()
+        MassEdit = pool.get('mass.editing')
+        MassEditWizardStart = pool.get('mass.editing.wizard.start')
+        Model = pool.get('ir.model')
+        ModelField = pool.get('ir.model.field')
+
+        model_party, = Model.search([
+            ('name', '=', 'party.party'),
+            ], limit=1)
+        field_name, = ModelField.search([
+            ('name', '=', 'name'),
+            ('model', '=', 'party.party'),
+            ], limit=1)
+        field_code, = ModelField.search([
+            ('name', '=', 'code'),
+            ('model', '=', 'party.party'),
+            ], limit=1)
+
+        massedit = MassEdit()
+        massedit.model = model_party
+        massedit.model_fields = [field_name]
+        massedit.save()
+
+        with Transaction().set_context(active_model='party.party'):
+            view = MassEditWizardStart.fields_view_get()
+            self.assertIn('selection_name', view['fields'])
+            self.assertNotIn('selection_code', view['fields'])
+            self.assertIs(MassEditWizardStart.fields_view_get(), view)
+
+            massedit.model_fields = [field_name, field_code]
+            massedit.save()
+
+            view = MassEditWizardStart.fields_view_get()
+            self.assertIn('selection_code', view['fields'])
+
+    @with_transaction()
+    def test_mass_editing_lazy_defaults(self):
+        "Test default values are computed when the operation is set"
+        pool = Pool()
+        MassEdit = pool.get('mass.editing')
+        MassEditWizardStart = pool.get('mass.editing.wizard.start')
+        Model = pool.get('ir.model')
+        ModelField = pool.get('ir.model.field')
+
+        model_party, = Model.search([
+            ('name', '=', 'party.party'),
+            ], limit=1)
+        field_active, = ModelField.search([
+            ('name', '=', 'active'),
+            ('model', '=', 'party.party'),
+            ], limit=1)
+
+        massedit = MassEdit()
+        massedit.model = model_party
+        massedit.model_fields = [field_active]
+        massedit.save()
+
+        with Transaction().set_context(active_model='party.party'):
+            view = MassEditWizardStart.fields_view_get()
+            self.assertEqual(
+                list(view['fields']['selection_active']['on_change']),
+                ['selection_active', 'active'])
+            self.assertEqual(MassEditWizardStart.default_get(
+                    ['selection_active', 'active']),
+                {'selection_active': ''})
+            self.assertEqual(MassEditWizardStart.on_change({
+                        'selection_active': 'set',
+                        'active': None,
+                        }, ['selection_active']),
+                {'active': True})
+            self.assertEqual(MassEditWizardStart.on_change({
+                        'selection_active': 'set',
+                        'active': False,
+                        }, ['selection_active']),
+                {})
+            self.assertEqual(MassEditWizardStart.on_change({
+                        'selection_active': 'remove',
+                        'active': None,
+                        }, ['selection_active']),
+                {})
+
+        with Transaction().set_context(
+                active_model='party.party', default_active=False):
+            self.assertEqual(MassEditWizardStart.default_get(
+                    ['selection_active', 'active']),
+                {'selection_active': '', 'active': False})
+
+    @with_transaction()
+    def test_mass_editing_pick_fields(self):
+        "Test wizard form limited to the picked fields"
+        pool = Pool()
+        MassEdit = pool.get('mass.editing')
+        MassEditingWizard = pool.get('mass.editing.wizard', type='wizard')
+        MassEditWizardPick = pool.get('mass.editing.wizard.pick')
+        Model = pool.get('ir.model')
+        ModelField = pool.get('ir.model.field')
+
+        model_party, = Model.search([
+            ('name', '=', 'party.party'),
+            ], limit=1)
+        massedit = MassEdit()
+        massedit.model = model_party
+        massedit.model_fields = ModelField.search([
+                ('model', '=', 'party.party'),
+                ('name', 'in', [
+                        'name', 'code', 'active', 'lang', 'replaced_by',
+                        'categories', 'addresses', 'contact_mechanisms',
+                        'identifiers', 'code_alnum']),
+                ])
+        massedit.save()
+        self.assertEqual(len(massedit.model_fields), 10)
+        names = [f.name for f in massedit.model_fields]
+
+        with Transaction().set_context(active_model='party.party'):
+            self.assertEqual(
+                [n for n, _ in MassEditWizardPick.get_field_names()], names)
+            session_id, _, _ = MassEditingWizard.create()
+            wizard = MassEditingWizard(session_id)
+            self.assertEqual(wizard.transition_choose(), 'pick')
+            wizard.pick.field_names = names[:2]
+            view = MassEditingWizard.states['start'].get_view(
+                wizard, 'start')
+
+            self.assertEqual(
+                {n for n in view['fields'] if n.startswith('selection_')},
+                {'selection_%s' % n for n in names[:2]})
+            self.assertNotIn('notebook', view['arch'])
+            self.assertEqual(
+                view['arch'].count('name="selection_%s"' % names[0]), 1)
+
+            massedit.model_fields = massedit.model_fields[:2]
+            massedit.save()
+            self.assertEqual(wizard.transition_choose(), 'start')
+
+    @with_transaction()
+    def test_mass_editing_xxx2many(self):
+        "Test mass editing of xxx2many fields"
+        pool = Pool()
+        MassEdit = pool.get('mass.editing')
+        MassEditingWizard = pool.get('mass.editing.wizard', type='wizard')
+        Execution = pool.get('mass.editing.execution')
+        Party = pool.get('party.party')
+        Category = pool.get('party.category')
+        Model = pool.get('ir.model')
+        ModelField = pool.get('ir.model.field')
+
+        model_party, = Model.search([
+            ('name', '=', 'party.party'),
+            ], limit=1)
+        model_fields = ModelField.search([
+            ('name', 'in', ['categories', 'addresses']),
+            ('model', '=', 'party.party'),
+            ])
+
+        massedit = MassEdit()
+        massedit.model = model_party
+        massedit.model_fields = model_fields
+        massedit.save()
+
+        category1, category2, category3 = Category.create([
+                {'name': 'A'},
+                {'name': 'B'},
+                {'name': 'C'},
+                ])
+        party1, party2 = Party.create([{
+                    'name': 'John',
+                    'categories': [('add', [category1.id])],
+                    'addresses': [('create', [{}, {}])],
+                    }, {
+                    'name': 'Julia',
+                    'categories': [('add', [category2.id])],
+                    'addresses': [('create', [{}])],
+                    }])
+
+        with Transaction().set_context(
+                active_model='party.party',
+                active_ids=[party1.id, party2.id],
+                ):
+            session_id, _, _ = MassEditingWizard.create()
+            masseditig = MassEditingWizard(session_id)
+            masseditig.start.selection_categories = 'set'
+            masseditig.start.categories = [category3.id]
+            masseditig.start.selection_addresses = 'remove_all'
+            masseditig.transition_update()
+
+        self.assertEqual(party1.categories, (category3,))
+        self.assertEqual(party2.categories, (category3,))
+        self.assertEqual(party1.addresses, ())
+        self.assertEqual(party2.addresses, ())
+
+        result = MassEdit.apply('party.party', {
+                'selection_categories': 'add',
+                'categories': [category1.id],
+                }, ids=[party1.id, party2.id])
+        self.assertEqual(result, {'processed': 2, 'written': 2, 'skipped': 0,
+            'failed': []})
+        result = MassEdit.apply('party.party', {
+                'selection_categories': 'remove',
+                'categories': [category1.id],
+                }, ids=[party1.id])
+        self.assertEqual(result, {'processed': 1, 'written': 1, 'skipped': 0,
+            'failed': []})
+        result = MassEdit.apply('party.party', {
+                'selection_categories': 'add',
+                'categories': [category1.id],
+                }, ids=[party1.id, party2.id])
+        self.assertEqual(result, {'processed': 2, 'written': 1, 'skipped': 1,
+            'failed': []})
+        self.assertEqual(
+            set(party1.categories), {category1, category3})
+
+        result = MassEdit.apply('party.party', {
+                'selection_addresses': 'set',
+                'addresses': [{'street': 'Main Street'}, {}],
+                }, ids=[party1.id, party2.id])
+        self.assertEqual(result['written'], 2)
+        for party in [party1, party2]:
+            self.assertEqual(
+                sorted(a.street or '' for a in party.addresses),
+                ['', 'Main Street'])
+            self.assertTrue(all(a.active for a in party.addresses))
+        execution = Execution.search([], order=[('id', 'DESC')], limit=1)[0]
+        self.assertEqual(execution.phases['create']['records'], 4)
+
+    @with_transaction()
+    def test_mass_editing_plan(self):
+        "Test mass editing plan is compiled once"
+        pool = Pool()
+        MassEdit = pool.get('mass.editing')
+        Model = pool.get('ir.model')
+        ModelField = pool.get('ir.model.field')
+
+        model_party, = Model.search([
+            ('name', '=', 'party.party'),
+            ], limit=1)
+        model_fields = ModelField.search([
+            ('name', 'in', ['name', 'categories', 'addresses']),
+            ('model', '=', 'party.party'),
+            ])
+
+        massedit = MassEdit()
+        massedit.model = model_party
+        massedit.model_fields = model_fields
+        massedit.save()
+
+        plan = massedit.get_plan()
+        self.assertIs(massedit.get_plan(), plan)
+        self.assertFalse(plan['name'].xxx2many)
+        self.assertTrue(plan['categories'].xxx2many)
+        self.assertFalse(plan['categories'].one2many)
+        self.assertEqual(plan['categories'].target_model, 'party.category')
+        self.assertTrue(plan['addresses'].one2many)
+        self.assertNotIn('full_address', plan['addresses'].target_fields)
+
+    @with_transaction()
+    def test_mass_editing_preview(self):
+        "Test mass editing preview"
+        pool = Pool()
+        MassEdit = pool.get('mass.editing')
+        MassEditingWizard = pool.get('mass.editing.wizard', type='wizard')
+        Party = pool.get('party.party')
+        Model = pool.get('ir.model')
+        ModelField = pool.get('ir.model.field')
+
+        model_party, = Model.search([
+            ('name', '=', 'party.party'),
+            ], limit=1)
+        model_fields = ModelField.search([
+            ('name', 'in', ['name', 'addresses']),
+            ('model', '=', 'party.party'),
+            ])
+
+        massedit = MassEdit()
+        massedit.model = model_party
+        massedit.model_fields = model_fields
+        massedit.save()
+
+        party1, party2, party3 = Party.create([{
+                    'name': 'John',
+                    'addresses': [('create', [{}, {}])],
+                    }, {
+                    'name': 'Pepe',
+                    'addresses': [('create', [{}])],
+                    }, {
+                    'name': 'Julia',
+                    }])
+
+        with Transaction().set_context(
+                active_model='party.party',
+                active_ids=[party1.id, party2.id, party3.id],
+                ):
+            session_id, _, _ = MassEditingWizard.create()
+            masseditig = MassEditingWizard(session_id)
+            masseditig.start.selection_name = 'set'
+            masseditig.start.name = 'Pepe'
+            preview = masseditig.default_preview([])
+            self.assertEqual(preview['total'], 3)
+            self.assertEqual(preview['unchanged'], 1)
+            self.assertEqual(preview['to_change'], 2)
+            self.assertIn('John', preview['sample'])
+
+            masseditig.start.selection_addresses = 'remove_all'
+            preview = masseditig.default_preview([])
+            self.assertEqual(preview['unchanged'], 0)
+            self.assertEqual(preview['related'], 3)
+
+            session_id, _, _ = MassEditingWizard.create()
+            masseditig = MassEditingWizard(session_id)
+            masseditig.preview.values = {
+                'selection_name': 'set',
+                'name': 'Pepe',
+                }
+            masseditig.preview.skip_unchanged = True
+            write_date = party2.write_date
+            masseditig.transition_update()
+
+        self.assertEqual(party1.name, 'Pepe')
+        self.assertEqual(party2.write_date, write_date)
+        self.assertEqual(party3.name, 'Pepe')
+
+    @with_transaction()
+    def test_mass_editing_dict(self):
+        "Test mass editing merges dict fields"
+        pool = Pool()
+        MassEdit = pool.get('mass.editing')
+        MassEditingWizard = pool.get('mass.editing.wizard', type='wizard')
+        Queue = pool.get('ir.queue')
+        Model = pool.get('ir.model')
+        ModelField = pool.get('ir.model.field')
+
+        model_queue, = Model.search([
+            ('name', '=', 'ir.queue'),
+            ], limit=1)
+        field_data, = ModelField.search([
+            ('name', '=', 'data'),
+            ('model', '=', 'ir.queue'),
+            ], limit=1)
+
+        massedit = MassEdit()
+        massedit.model = model_queue
+        massedit.model_fields = [field_data]
+        massedit.save()
+
+        task1, task2, task3 = Queue.create([
+                {'name': 'test', 'data': {'a': 1}},
+                {'name': 'test', 'data': {'a': 2, 'c': 3}},
+                {'name': 'test', 'data': None},
+                ])
+
+        with Transaction().set_context(
+                active_model='ir.queue',
+                active_ids=[task1.id, task2.id, task3.id],
+                ):
+            session_id, _, _ = MassEditingWizard.create()
+            masseditig = MassEditingWizard(session_id)
+            masseditig.start.selection_data = 'set'
+            masseditig.start.data = {'b': 4, 'c': None}
+            masseditig.transition_update()
+
+        self.assertEqual(task1.data, {'a': 1, 'b': 4})
+        self.assertEqual(task2.data, {'a': 2, 'b': 4})
+        self.assertEqual(task3.data, {'b': 4})
+
+        # The removed keys are not stored so the records are unchanged
+        result = MassEdit.apply('ir.queue', {
+                'selection_data': 'set',
+                'data': {'b': 4, 'c': None},
+                }, ids=[task1.id, task2.id, task3.id])
+        self.assertEqual(result['written'], 0)
+        self.assertEqual(result['skipped'], 3)
+
+        # The sample shows the removed keys as the edit does
+        preview = massedit.preview({
+                'selection_data': 'set',
+                'data': {'a': None, 'b': 5},
+                }, ids=[task1.id])
+        self.assertIn("{'a': 1, 'b': 4} -> {'b': 5}", preview['sample'])
+
+    @with_transaction()
+    def test_mass_editing_direct_sql(self):
+        "Test mass editing by direct SQL"
+        pool = Pool()
+        MassEdit = pool.get('mass.editing')
+        Queue = pool.get('ir.queue')
+        Party = pool.get('party.party')
+        Model = pool.get('ir.model')
+        ModelField = pool.get('ir.model.field')
+
+        self.assertTrue(MassEdit._is_sql_safe(Queue, ['name'], {
+                    'name': 'test'}))
+        self.assertFalse(MassEdit._is_sql_safe(Queue, ['name'], {
+                    'name': None}))
+        self.assertFalse(MassEdit._is_sql_safe(Party, ['name'], {
+                    'name': 'test'}))
+
+        model_queue, = Model.search([
+            ('name', '=', 'ir.queue'),
+            ], limit=1)
+        field_name, = ModelField.search([
+            ('name', '=', 'name'),
+            ('model', '=', 'ir.queue'),
+            ], limit=1)
+
+        massedit = MassEdit()
+        massedit.model = model_queue
+        massedit.model_fields = [field_name]
+        massedit.sql_fields = [field_name]
+        massedit.save()
+
+        task1, task2 = Queue.create([
+                {'name': 'foo'},
+                {'name': 'bar'},
+                ])
+
+        MassEdit.apply('ir.queue', {
+                'selection_name': 'set',
+                'name': 'test',
+                }, ids=[task1.id, task2.id])
+
+        self.assertEqual(task1.name, 'test')
+        self.assertEqual(task2.name, 'test')
+        self.assertTrue(task1.write_date)
+
+    @with_transaction()
+    def test_mass_editing_batch(self):
+        "Test mass editing by chunks resuming from checkpoint"
+        pool = Pool()
+        MassEdit = pool.get('mass.editing')
+        Checkpoint = pool.get('mass.editing.checkpoint')
+        MassEditingWizard = pool.get('mass.editing.wizard', type='wizard')
+        Party = pool.get('party.party')
+        Model = pool.get('ir.model')
+        ModelField = pool.get('ir.model.field')
+
+        model_party, = Model.search([
+            ('name', '=', 'party.party'),
+            ], limit=1)
+        field_name, = ModelField.search([
+            ('name', '=', 'name'),
+            ('model', '=', 'party.party'),
+            ], limit=1)
+
+        massedit = MassEdit()
+        massedit.model = model_party
+        massedit.model_fields = [field_name]
+        massedit.batch = True
+        massedit.chunk_size = 1
+        massedit.lock = 'defer'
+        massedit.save()
+
+        party1, party2, party3 = Party.create([
+                {'name': 'John'},
+                {'name': 'Julia'},
+                {'name': 'Jane'},
+                ])
+        values = {'selection_name': 'set', 'name': 'Pepe'}
+        # Simulate an execution interrupted after the first chunk
+        Checkpoint.create([{
+                    'mass_edit': massedit.id,
+                    'key': MassEdit._run_key(
+                        values, [party1.id, party2.id, party3.id], None),
+                    'checkpoint': party1.id,
+                    }])
+
+        with Transaction().set_context(
+                active_model='party.party',
+                active_ids=[party3.id, party2.id, party1.id],
+                ):
+            session_id, _, _ = MassEditingWizard.create()
+            masseditig = MassEditingWizard(session_id)
+            masseditig.start.selection_name = 'set'
+            masseditig.start.name = 'Pepe'
+            masseditig.transition_update()
+
+        self.assertEqual(party1.name, 'John')
+        self.assertEqual(party2.name, 'Pepe')
+        self.assertEqual(party3.name, 'Pepe')
+        self.assertEqual(massedit.checkpoints, ())
+        self.assertEqual(masseditig.result['failed'], [])
+
+        # The checkpoint of another run is not resumed
+        Checkpoint.create([{
+                    'mass_edit': massedit.id,
+                    'key': MassEdit._run_key(values, [party2.id], None),
+                    'checkpoint': party2.id,
+                    }])
+        result = MassEdit.apply('party.party', {
+                'selection_name': 'set',
+                'name': 'Jane',
+                }, ids=[party1.id, party2.id, party3.id])
+
+        self.assertEqual(result['processed'], 3)
+        self.assertEqual(
+            [p.name for p in [party1, party2, party3]], ['Jane'] * 3)
+        self.assertEqual(Checkpoint.search([]), [])
+
+    @unittest.skipIf(backend.name != 'postgresql', 'requires row locks')
+    @with_transaction()
+    def test_mass_editing_lock(self):
+        "Test mass editing skips the records locked by others"
+        pool = Pool()
+        MassEdit = pool.get('mass.editing')
+        Group = pool.get('res.group')
+        Model = pool.get('ir.model')
+        ModelField = pool.get('ir.model.field')
+
+        group1, group2 = Group.search([], order=[('id', 'ASC')], limit=2)
+        # Lock a row committed before the test
+        table = Group.__table__()
+        cursor = Transaction().connection.cursor()
+        cursor.execute(*table.select(table.id,
+                where=table.id == group1.id, for_=For('UPDATE')))
+
+        with Transaction().new_transaction() as transaction:
+            try:
+                model_group, = Model.search([
+                    ('name', '=', 'res.group'),
+                    ], limit=1)
+                field_name, = ModelField.search([
+                    ('name', '=', 'name'),
+                    ('model', '=', 'res.group'),
+                    ], limit=1)
+
+                massedit = MassEdit()
+                massedit.model = model_group
+                massedit.model_fields = [field_name]
+                massedit.lock = 'skip'
+                massedit.save()
+
+                result = massedit.execute([group1.id, group2.id], {
+                        'selection_name': 'set',
+                        'name': 'Test',
+                        })
+
+                self.assertEqual(result['failed'], [group1.id])
+                self.assertEqual(result['written'], 1)
+                self.assertEqual(result['skipped'], 0)
+                self.assertEqual(Group(group2.id).name, 'Test')
+            finally:
+                transaction.rollback()
+
+    @with_transaction()
+    def test_mass_editing_domain(self):
+        "Test mass editing records matching a domain"
+        pool = Pool()
+        MassEdit = pool.get('mass.editing')
+        Party = pool.get('party.party')
+        Model = pool.get('ir.model')
+        ModelField = pool.get('ir.model.field')
+
+        model_party, = Model.search([
+            ('name', '=', 'party.party'),
+            ], limit=1)
+        field_name, = ModelField.search([
+            ('name', '=', 'name'),
+            ('model', '=', 'party.party'),
+            ], limit=1)
+
+        massedit = MassEdit()
+        massedit.model = model_party
+        massedit.model_fields = [field_name]
+        massedit.batch = True
+        massedit.chunk_size = 2
+        massedit.save()
+
+        parties = Party.create([
+                {'name': 'John'},
+                {'name': 'Julia'},
+                {'name': 'Jane'},
+                {'name': 'Anna'},
+                ])
+
+        MassEdit.apply('party.party', {
+                'selection_name': 'set',
+                'name': 'Pepe',
+                }, domain=[('name', 'like', 'J%')])
+
+        self.assertEqual(
+            [p.name for p in parties], ['Pepe', 'Pepe', 'Pepe', 'Anna'])
+
+        for target in [{}, {'ids': [parties[0].id], 'domain': []}]:
+            for background in [False, True]:
+                with self.assertRaises(UserError):
+                    MassEdit.apply('party.party', {
+                            'selection_name': 'set',
+                            'name': 'Pepe',
+                            }, background=background, **target)
+
+    @with_transaction()
+    def test_mass_editing_background(self):
+        "Test mass editing as background job"
+        pool = Pool()
+        MassEdit = pool.get('mass.editing')
+        MassEditingWizard = pool.get('mass.editing.wizard', type='wizard')
+        Job = pool.get('mass.editing.job')
+        Party = pool.get('party.party')
+        Model = pool.get('ir.model')
+        ModelField = pool.get('ir.model.field')
+
+        model_party, = Model.search([
+            ('name', '=', 'party.party'),
+            ], limit=1)
+        field_name, = ModelField.search([
+            ('name', '=', 'name'),
+            ('model', '=', 'party.party'),
+            ], limit=1)
+
+        massedit = MassEdit()
+        massedit.model = model_party
+        massedit.model_fields = [field_name]
+        massedit.save()
+
+        party1, party2 = Party.create([
+                {'name': 'John'},
+                {'name': 'Julia'},
+                ])
+
+        with Transaction().set_context(
+                active_model='party.party',
+                active_ids=[party1.id, party2.id],
+                ):
+            session_id, _, _ = MassEditingWizard.create()
+            masseditig = MassEditingWizard(session_id)
+            masseditig.start.selection_name = 'set'
+            masseditig.start.name = 'Pepe'
+            masseditig.transition_background()
+
+        job, = Job.search([])
+        self.assertEqual(job.state, 'enqueued')
+        self.assertEqual(job.total, 2)
+        self.assertEqual(party1.name, 'John')
+
+        Job.process([job])
+
+        self.assertEqual(job.state, 'done')
+        self.assertEqual(job.processed, 2)
+        self.assertEqual(party1.name, 'Pepe')
+        self.assertEqual(party2.name, 'Pepe')
+
+    @with_transaction()
+    def test_mass_editing_background_access(self):
+        "Test background mass editing checks the access of the user"
+        pool = Pool()
+        MassEdit = pool.get('mass.editing')
+        Job = pool.get('mass.editing.job')
+        Group = pool.get('res.group')
+        User = pool.get('res.user')
+        Model = pool.get('ir.model')
+        ModelField = pool.get('ir.model.field')
+
+        model_group, = Model.search([
+            ('name', '=', 'res.group'),
+            ], limit=1)
+        field_name, = ModelField.search([
+            ('name', '=', 'name'),
+            ('model', '=', 'res.group'),
+            ], limit=1)
+
+        massedit = MassEdit()
+        massedit.model = model_group
+        massedit.model_fields = [field_name]
+        massedit.save()
+
+        group, = Group.create([{'name': 'Test'}])
+        user, = User.create([{'name': 'Test', 'login': 'test'}])
+
+        with Transaction().set_user(user.id), check_access():
+            with self.assertRaises(AccessError):
+                MassEdit.apply('res.group', {
+                        'selection_name': 'set',
+                        'name': 'HACK',
+                        }, ids=[group.id], background=True)
+
+        self.assertEqual(Job.search([]), [])
+        self.assertEqual(group.name, 'Test')
+
+    @with_transaction()
+    def test_mass_editing_undo(self):
+        "Test undo of mass editing"
+        pool = Pool()
+        MassEdit = pool.get('mass.editing')
+        Undo = pool.get('mass.editing.undo')
+        Party = pool.get('party.party')
+        Category = pool.get('party.category')
+        Model = pool.get('ir.model')
+        ModelField = pool.get('ir.model.field')
+
+        model_party, = Model.search([
+            ('name', '=', 'party.party'),
+            ], limit=1)
+        model_fields = ModelField.search([
+            ('name', 'in', ['name', 'categories']),
+            ('model', '=', 'party.party'),
+            ])
+
+        massedit = MassEdit()
+        massedit.model = model_party
+        massedit.model_fields = model_fields
+        massedit.batch = True
+        massedit.chunk_size = 2
+        massedit.save()
+
+        category1, category2 = Category.create([
+                {'name': 'A'},
+                {'name': 'B'},
+                ])
+        party1, party2, party3 = Party.create([{
+                    'name': 'John',
+                    'categories': [('add', [category1.id])],
+                    }, {
+                    'name': 'John',
+                    }, {
+                    'name': 'Pepe',
+                    'categories': [('add', [category2.id])],
+                    }])
+
+        result = MassEdit.apply('party.party', {
+                'selection_name': 'set',
+                'name': 'Pepe',
+                'selection_categories': 'set',
+                'categories': [category2.id],
+                }, ids=[party1.id, party2.id, party3.id])
+        self.assertEqual(result['written'], 2)
+
+        undo, = Undo.search([])
+        self.assertEqual(undo.records, 2)
+        self.assertEqual(undo.irreversible, False)
+        self.assertEqual(len(undo.lines), 3)
+        self.assertEqual(party1.name, 'Pepe')
+        self.assertEqual(party1.categories, (category2,))
+
+        Undo.undo([undo])
+
+        self.assertEqual(undo.state, 'undone')
+        self.assertEqual(
+            [p.name for p in [party1, party2, party3]],
+            ['John', 'John', 'Pepe'])
+        self.assertEqual(party1.categories, (category1,))
+        self.assertEqual(party2.categories, ())
+        self.assertEqual(party3.categories, (category2,))
+
+    @with_transaction()
+    def test_mass_editing_undo_create(self):
+        "Test undo of mass editing deletes the created lines"
+        pool = Pool()
+        MassEdit = pool.get('mass.editing')
+        Undo = pool.get('mass.editing.undo')
+        Party = pool.get('party.party')
+        Address = pool.get('party.address')
+        Model = pool.get('ir.model')
+        ModelField = pool.get('ir.model.field')
+
+        model_party, = Model.search([
+            ('name', '=', 'party.party'),
+            ], limit=1)
+        field_addresses, = ModelField.search([
+            ('name', '=', 'addresses'),
+            ('model', '=', 'party.party'),
+            ], limit=1)
+
+        massedit = MassEdit()
+        massedit.model = model_party
+        massedit.model_fields = [field_addresses]
+        massedit.save()
+
+        party, = Party.create([{'name': 'John'}])
+        addresses = party.addresses
+
+        MassEdit.apply('party.party', {
+                'selection_addresses': 'set',
+                'addresses': [{'city': 'Paris'}],
+                }, ids=[party.id])
+        self.assertEqual(len(party.addresses), len(addresses) + 1)
+
+        undo, = Undo.search([])
+        self.assertEqual(undo.irreversible, False)
+        Undo.undo([undo])
+
+        self.assertEqual(party.addresses, addresses)
+        self.assertEqual(Address.search([('city', '=', 'Paris')]), [])
+
+    @with_transaction()
+    def test_mass_editing_execution(self):
+        "Test the metrics of mass editing are stored"
+        pool = Pool()
+        MassEdit = pool.get('mass.editing')
+        Execution = pool.get('mass.editing.execution')
+        Party = pool.get('party.party')
+        Category = pool.get('party.category')
+        Model = pool.get('ir.model')
+        ModelField = pool.get('ir.model.field')
+
+        model_party, = Model.search([
+            ('name', '=', 'party.party'),
+            ], limit=1)
+        model_fields = ModelField.search([
+            ('name', 'in', ['name', 'categories']),
+            ('model', '=', 'party.party'),
+            ])
+
+        massedit = MassEdit()
+        massedit.model = model_party
+        massedit.model_fields = model_fields
+        massedit.save()
+
+        category, = Category.create([{'name': 'A'}])
+        party1, party2 = Party.create([
+                {'name': 'John'},
+                {'name': 'Pepe'},
+                ])
+
+        MassEdit.apply('party.party', {
+                'selection_name': 'set',
+                'name': 'Pepe',
+                'selection_categories': 'set',
+                'categories': [category.id],
+                }, ids=[party1.id, party2.id])
+
+        execution, = Execution.search([])
+        self.assertEqual(execution.mass_edit, massedit)
+        self.assertEqual(execution.processed, 2)
+        self.assertEqual(execution.written, 2)
+        self.assertGreater(execution.duration, datetime.timedelta(0))
+        self.assertEqual(execution.phases['write']['records'], 2)
+        self.assertEqual(execution.phases['diff']['calls'], 2)
+        self.assertIn('write:', execution.summary)
+
+    @with_transaction()
+    def test_mass_editing_parallel(self):
+        "Test mass editing as background job split in partitions"
+        pool = Pool()
+        MassEdit = pool.get('mass.editing')
+        Job = pool.get('mass.editing.job')
+        Party = pool.get('party.party')
+        Model = pool.get('ir.model')
+        ModelField = pool.get('ir.model.field')
+
+        model_party, = Model.search([
+            ('name', '=', 'party.party'),
+            ], limit=1)
+        field_name, = ModelField.search([
+            ('name', '=', 'name'),
+            ('model', '=', 'party.party'),
+            ], limit=1)
+
+        massedit = MassEdit()
+        massedit.model = model_party
+        massedit.model_fields = [field_name]
+        massedit.parallel = 2
+        massedit.save()
+
+        parties = Party.create([{'name': 'John'} for _ in range(5)])
+        values = {
+            'selection_name': 'set',
+            'name': 'Pepe',
+            }
+
+        job_id = MassEdit.apply('party.party', values,
+            ids=[p.id for p in parties], background=True)
+        job = Job(job_id)
+        self.assertEqual(job.state, 'running')
+        partition1, partition2 = job.partitions
+        self.assertEqual(partition1.total + partition2.total, 5)
+        self.assertFalse(
+            set(partition1.target_ids) & set(partition2.target_ids))
+
+        Job.process([partition1])
+        self.assertEqual(job.state, 'running')
+        Job.process([partition2])
+        self.assertEqual(job.state, 'done')
+        self.assertEqual(job.processed, 5)
+        self.assertEqual({p.name for p in parties}, {'Pepe'})
+
+        job_id = MassEdit.apply('party.party', {
+                'selection_name': 'set',
+                'name': 'Julia',
+                }, domain=[('name', '=', 'Pepe')], background=True)
+        job = Job(job_id)
+        Job.process(job.partitions)
+        self.assertEqual(job.state, 'done')
+        self.assertEqual(job.processed, 5)
+        self.assertEqual({p.name for p in parties}, {'Julia'})
+
+    @with_transaction()
+    def test_mass_editing_cancel(self):
+        "Test the cancellation of a background job between chunks"
+        pool = Pool()
+        MassEdit = pool.get('mass.editing')
+        Job = pool.get('mass.editing.job')
+        Party = pool.get('party.party')
+        Model = pool.get('ir.model')
+        ModelField = pool.get('ir.model.field')
+
+        model_party, = Model.search([
+            ('name', '=', 'party.party'),
+            ], limit=1)
+        field_name, = ModelField.search([
+            ('name', '=', 'name'),
+            ('model', '=', 'party.party'),
+            ], limit=1)
+
+        massedit = MassEdit()
+        massedit.model = model_party
+        massedit.model_fields = [field_name]
+        massedit.batch = True
+        massedit.chunk_size = 2
+        massedit.save()
+
+        parties = Party.create([{'name': 'John'} for _ in range(5)])
+
+        job_id = MassEdit.apply('party.party', {
+                'selection_name': 'set',
+                'name': 'Pepe',
+                }, domain=[('name', '=', 'John')], background=True)
+        job = Job(job_id)
+        Job.cancel([job])
+        Job.process([job])
+        self.assertEqual(job.state, 'cancelled')
+        self.assertEqual(job.processed, 0)
+        self.assertEqual({p.name for p in parties}, {'John'})
+
+        Job.enqueue([job])
+        self.assertFalse(job.cancel_requested())
+        # The cancellation is requested once the first chunk is written
+        chunk_done = MassEdit._chunk_done
+
+        def cancel_after_chunk(self, *args, **kwargs):
+            chunk_done(self, *args, **kwargs)
+            Job.cancel([job])
+        with patch.object(MassEdit, '_chunk_done', cancel_after_chunk):
+            Job.process([job])
+        self.assertEqual(job.state, 'cancelled')
+        self.assertEqual(job.total, 5)
+        self.assertEqual(job.processed, 2)
+        self.assertEqual(job.checkpoint, parties[1].id)
+        self.assertEqual(job.estimated_end, None)
+        self.assertEqual(
+            [p.name for p in parties], ['Pepe'] * 2 + ['John'] * 3)
+
+        Job.enqueue([job])
+        Job.process([job])
+        self.assertEqual(job.state, 'done')
+        self.assertEqual(job.processed, 5)
+        self.assertEqual({p.name for p in parties}, {'Pepe'})
+
+    @with_transaction()
+    def test_mass_editing_cancel_access(self):
+        "Test the creator of a job can cancel it"
+        pool = Pool()
+        MassEdit = pool.get('mass.editing')
+        Job = pool.get('mass.editing.job')
+        Cancellation = pool.get('mass.editing.job.cancellation')
+        User = pool.get('res.user')
+        Model = pool.get('ir.model')
+
+        model_party, = Model.search([
+            ('name', '=', 'party.party'),
+            ], limit=1)
+        massedit = MassEdit(model=model_party)
+        massedit.save()
+
+        creator, other = User.create([
+                {'name': 'Creator', 'login': 'creator'},
+                {'name': 'Other', 'login': 'other'},
+                ])
+        with Transaction().set_user(creator.id):
+            job, = Job.create([{
+                        'mass_edit': massedit.id,
+                        'state': 'enqueued',
+                        'record_ids': '[]',
+                        }])
+
+        with Transaction().set_user(other.id), check_access():
+            with self.assertRaises(AccessError):
+                Job.cancel([Job(job.id)])
+        self.assertEqual(Cancellation.search([]), [])
+
+        with Transaction().set_user(creator.id), check_access():
+            Job.cancel([Job(job.id)])
+        self.assertTrue(job.cancel_requested())
+
+    @with_transaction()
+    def test_mass_editing_coalesce(self):
+        "Test the enqueued jobs setting the same fields are merged"
+        pool = Pool()
+        MassEdit = pool.get('mass.editing')
+        Job = pool.get('mass.editing.job')
+        Party = pool.get('party.party')
+        Model = pool.get('ir.model')
+        ModelField = pool.get('ir.model.field')
+
+        model_party, = Model.search([
+            ('name', '=', 'party.party'),
+            ], limit=1)
+        field_name, = ModelField.search([
+            ('name', '=', 'name'),
+            ('model', '=', 'party.party'),
+            ], limit=1)
+
+        massedit = MassEdit()
+        massedit.model = model_party
+        massedit.model_fields = [field_name]
+        massedit.save()
+
+        party1, party2, party3 = Party.create([
+                {'name': 'John'},
+                {'name': 'Julia'},
+                {'name': 'Jane'},
+                ])
+
+        job1 = Job(MassEdit.apply('party.party', {
+                    'selection_name': 'set',
+                    'name': 'Pepe',
+                    }, ids=[party1.id, party2.id, party3.id],
+                background=True))
+        job2 = Job(MassEdit.apply('party.party', {
+                    'selection_name': 'set',
+                    'name': 'Paco',
+                    }, ids=[party2.id, party3.id], background=True))
+        Job.process([job1])
+        self.assertEqual(job1.state, 'done')
+        self.assertEqual(job1.total, 3)
+        self.assertEqual(job1.processed, 3)
+        self.assertEqual(job1.superseded, 2)
+        self.assertEqual(job2.state, 'done')
+        self.assertEqual(job2.merged_into, job1)
+        self.assertEqual(job2.processed, 2)
+        self.assertEqual(job2.superseded, 0)
+        self.assertEqual(
+            [p.name for p in [party1, party2, party3]],
+            ['Pepe', 'Paco', 'Paco'])
+        # The task of the merged job leaves it
+        Job.process([job2])
+        self.assertEqual(job2.state, 'done')
+
+        # A job whose cancellation is requested is not merged
+        job5 = Job(MassEdit.apply('party.party', {
+                    'selection_name': 'set',
+                    'name': 'Juan',
+                    }, ids=[party3.id], background=True))
+        job6 = Job(MassEdit.apply('party.party', {
+                    'selection_name': 'set',
+                    'name': 'Jose',
+                    }, ids=[party3.id], background=True))
+        Job.cancel([job6])
+        Job.process([job5, job6])
+        self.assertEqual(job5.superseded, 0)
+        self.assertEqual(job6.merged_into, None)
+        self.assertEqual(job6.state, 'cancelled')
+        self.assertEqual(party3.name, 'Juan')
+
+        # The computed values depend on the values of the records
+        job3 = Job(MassEdit.apply('party.party', {
+                    'selection_name': 'compute',
+                    'expression_name': "name + '!'",
+                    }, ids=[party1.id, party2.id], background=True))
+        job4 = Job(MassEdit.apply('party.party', {
+                    'selection_name': 'set',
+                    'name': 'Pepe',
+                    }, ids=[party2.id], background=True))
+        Job.process([job3, job4])
+        self.assertEqual(job3.processed, 2)
+        self.assertEqual(job3.superseded, 0)
+        self.assertEqual(job4.merged_into, None)
+        self.assertEqual([p.name for p in [party1, party2]], ['Pepe!', 'Pepe'])
+
+    @with_transaction()
+    def test_mass_editing_compute(self):
+        "Test mass editing with expressions"
+        pool = Pool()
+        MassEdit = pool.get('mass.editing')
+        MassEditWizardStart = pool.get('mass.editing.wizard.start')
+        Execution = pool.get('mass.editing.execution')
+        Queue = pool.get('ir.queue')
+        Party = pool.get('party.party')
+        Sequence = pool.get('ir.sequence')
+        Model = pool.get('ir.model')
+        ModelField = pool.get('ir.model.field')
+
+        expression = Expression(Sequence, '(padding + 1) * 2 / 3')
+        self.assertEqual(expression.names, {'padding'})
+        self.assertEqual(
+            expression.evaluate({'padding': 2}, 'number_increment'), 2)
+        self.assertEqual(
+            expression.evaluate({'padding': None}, 'number_increment'), None)
+        for text in ['padding +', '__import__("os")', 'name * 2', 'code',
+                'padding / 0', 'padding / -0.0']:
+            with self.assertRaises(UserError):
+                Expression(Sequence, text)
+        # Rounded half away from zero like by SQL
+        expression = Expression(Sequence, 'padding / 2')
+        self.assertEqual(
+            expression.evaluate({'padding': 5}, 'number_increment'), 3)
+        self.assertEqual(
+            expression.evaluate({'padding': -5}, 'number_increment'), -3)
+        expression = Expression(Sequence, 'number_increment / padding')
+        self.assertFalse(expression.is_sql('number_increment'))
+        with self.assertRaises(UserError):
+            expression.evaluate(
+                {'id': 1, 'number_increment': 1, 'padding': 0},
+                'number_increment')
+
+        for model, field in [('ir.queue', 'name'), ('party.party', 'name')]:
+            model, = Model.search([('name', '=', model)])
+            field, = ModelField.search([
+                    ('name', '=', field),
+                    ('model', '=', model.name),
+                    ])
+            massedit = MassEdit(model=model, model_fields=[field])
+            if model.name == 'ir.queue':
+                massedit.sql_fields = [field]
+            massedit.save()
+
+        with Transaction().set_context(active_model='party.party'):
+            view = MassEditWizardStart.fields_view_get()
+        self.assertIn('expression_name', view['fields'])
+        self.assertIn('compute',
+            dict(view['fields']['selection_name']['selection']))
+
+        task1, task2 = Queue.create([
+                {'name': 'foo'},
+                {'name': 'bar'},
+                ])
+        party1, party2 = Party.create([
+                {'name': 'John'},
+                {'name': 'Julia'},
+                ])
+        values = {
+            'selection_name': 'compute',
+            'expression_name': "name + '-old'",
+            }
+
+        MassEdit.apply('ir.queue', values, ids=[task1.id, task2.id])
+        MassEdit.apply('party.party', values, ids=[party1.id, party2.id])
+
+        self.assertEqual([task1.name, task2.name], ['foo-old', 'bar-old'])
+        self.assertEqual(
+            [party1.name, party2.name], ['John-old', 'Julia-old'])
+        queue_execution, party_execution = Execution.search([],
+            order=[('id', 'ASC')])
+        self.assertIn('sql', queue_execution.phases)
+        self.assertNotIn('sql', party_execution.phases)
+
+    @with_transaction()
+    def test_mass_editing_recompute(self):
+        "Test mass editing with deferred computation of stored fields"
+        pool = Pool()
+        MassEdit = pool.get('mass.editing')
+        Execution = pool.get('mass.editing.execution')
+        Queue = pool.get('ir.queue')
+        Party = pool.get('party.party')
+        Model = pool.get('ir.model')
+        ModelField = pool.get('ir.model.field')
+
+        model, = Model.search([('name', '=', 'party.party')])
+        field, = ModelField.search([
+                ('name', '=', 'code'),
+                ('model', '=', 'party.party'),
+                ])
+        massedit = MassEdit(model=model, model_fields=[field])
+        massedit.save()
+        self.assertEqual(massedit.recompute, None)
+        massedit.recompute = 'chunk'
+        massedit.save()
+        parties = Party.create([
+                {'name': 'John', 'code': 'P1'},
+                {'name': 'Julia', 'code': 'P2'},
+                ])
+        ids = [p.id for p in parties]
+
+        massedit.execute(ids, {
+                'selection_code': 'compute',
+                'expression_code': "code + '-9'",
+                })
+        self.assertEqual([(p.code, p.code_alnum, p.code_digit)
+                for p in parties], [('P1-9', 'P19', 19), ('P2-9', 'P29', 29)])
+        execution, = Execution.search([])
+        self.assertEqual(execution.phases['recompute']['records'], 2)
+
+        massedit.recompute = 'queue'
+        massedit.save()
+        tasks = Queue.search([])
+        massedit.execute(ids, {
+                'selection_code': 'compute',
+                'expression_code': "code + '0'",
+                })
+        self.assertEqual([p.code_alnum for p in parties], ['P19', 'P29'])
+        task, = Queue.search([('id', 'not in', [t.id for t in tasks])])
+        self.assertEqual(task.data['method'], 'mass_edit_compute_fields')
+        task.run()
+        self.assertEqual([(p.code_alnum, p.code_digit) for p in parties],
+            [('P190', 190), ('P290', 290)])
+
+    @with_transaction()
+    def test_mass_editing_validation(self):
+        "Test mass editing with validation by chunk"
+        pool = Pool()
+        MassEdit = pool.get('mass.editing')
+        Trigger = pool.get('ir.trigger')
+        Category = pool.get('party.category')
+        Model = pool.get('ir.model')
+        ModelField = pool.get('ir.model.field')
+
+        model, = Model.search([('name', '=', 'party.category')])
+        field, = ModelField.search([
+                ('name', '=', 'name'),
+                ('model', '=', 'party.category'),
+                ])
+        massedit = MassEdit(model=model, model_fields=[field],
+            validation='chunk')
+        massedit.save()
+        category1, category2 = Category.create([
+                {'name': 'A'},
+                {'name': 'B'},
+                ])
+        ids = [category1.id, category2.id]
+
+        result = massedit.execute(ids[:1], {
+                'selection_name': 'set',
+                'name': 'C',
+                })
+        self.assertEqual(result['written'], 1)
+        self.assertEqual([c.name for c in Category.browse(ids)], ['C', 'B'])
+
+        with self.assertRaises(UserError) as cm:
+            massedit.execute(ids, {
+                    'selection_name': 'remove',
+                    })
+        self.assertIn('%s: ' % category1.id, cm.exception.message)
+        self.assertIn('%s: ' % category2.id, cm.exception.message)
+
+        name_trigger = Trigger(model=model,
+            condition='{"__class__": "Eval", "v": "self.name", "d": ""}')
+        parent_trigger = Trigger(model=model,
+            condition='{"__class__": "Eval", "v": "self.parent", "d": ""}')
+        date_trigger = Trigger(model=model,
+            condition='{"__class__": "Eval", "v": "current_date", "d": ""}')
+        self.assertTrue(name_trigger.depends_on({'name'}))
+        self.assertFalse(parent_trigger.depends_on({'name'}))
+        self.assertTrue(date_trigger.depends_on({'name'}))
+
+    @with_transaction()
+    def test_mass_editing_preset(self):
+        "Test mass editing presets"
+        pool = Pool()
+        MassEdit = pool.get('mass.editing')
+        Preset = pool.get('mass.editing.preset')
+        MassEditingWizard = pool.get('mass.editing.wizard', type='wizard')
+        Cron = pool.get('ir.cron')
+        Party = pool.get('party.party')
+        Model = pool.get('ir.model')
+        ModelField = pool.get('ir.model.field')
+
+        model, = Model.search([('name', '=', 'party.party')])
+        field, = ModelField.search([
+                ('name', '=', 'name'),
+                ('model', '=', 'party.party'),
+                ])
+        massedit = MassEdit(model=model, model_fields=[field])
+        massedit.save()
+        parties = Party.create([{'name': 'John'}, {'name': 'Julia'}])
+
+        preset = Preset(mass_edit=massedit, name='Rename',
+            domain='[["name", "=", "John"]]', incremental=True,
+            values={
+                'selection_name': 'set',
+                'name': 'Pepe',
+                })
+        preset.save()
+        self.assertIn('mass.editing.preset|run_cron',
+            dict(Cron.fields_get(['method'])['method']['selection']))
+
+        result = preset.execute()
+        self.assertEqual(result['written'], 1)
+        self.assertEqual([p.name for p in parties], ['Pepe', 'Julia'])
+        self.assertTrue(preset.last_run)
+
+        preset.domain = None
+        preset.last_run += datetime.timedelta(days=1)
+        preset.save()
+        Preset.run_cron()
+        self.assertEqual([p.name for p in parties], ['Pepe', 'Julia'])
+
+        Preset.reset_last_run([preset])
+        Preset.run_cron()
+        self.assertEqual([p.name for p in parties], ['Pepe', 'Pepe'])
+
+        with Transaction().set_context(active_model='party.party',
+                active_ids=[parties[0].id]):
+            session_id, _, _ = MassEditingWizard.create()
+            wizard = MassEditingWizard(session_id)
+            wizard.start.selection_name = 'set'
+            wizard.start.name = 'Jack'
+            wizard.preset = wizard.preset.__class__(
+                name='Saved', **wizard.default_preset(None))
+            wizard.transition_save_preset()
+        saved, = Preset.search([('name', '=', 'Saved')])
+        self.assertEqual(saved.mass_edit, massedit)
+        Preset.run([saved])
+        self.assertEqual([p.name for p in parties], ['Jack', 'Pepe'])
+
+        preset.values = {
+            'selection_name': 'compute',
+            'expression_name': "name + '-old'",
+            }
+        with self.assertRaises(UserError):
+            preset.save()
+
+    @with_transaction()
+    def test_mass_editing_csv(self):
+        "Test mass editing from a CSV file"
+        pool = Pool()
+        MassEdit = pool.get('mass.editing')
+        Party = pool.get('party.party')
+        Model = pool.get('ir.model')
+        ModelField = pool.get('ir.model.field')
+
+        model, = Model.search([('name', '=', 'party.party')])
+        massedit = MassEdit(model=model, chunk_size=2)
+        massedit.model_fields = ModelField.search([
+                ('model', '=', 'party.party'),
+                ('name', 'in', ['name', 'categories']),
+                ])
+        massedit.save()
+        party1, party2, party3 = Party.create([
+                {'name': 'John', 'code': 'P1'},
+                {'name': 'Julia', 'code': 'P2'},
+                {'name': 'Jack', 'code': 'P3'},
+                ])
+
+        result = massedit.execute_csv([
+                'id,name',
+                '%s,Foo' % party1.id,
+                '%s,Foo' % party2.id,
+                '%s,Jack' % party3.id,
+                '0,Bar',
+                ])
+        self.assertEqual(result, {
+                'processed': 4,
+                'written': 2,
+                'skipped': 1,
+                'unmatched': 1,
+                'unmatched_keys': [0],
+                'duplicates': 0,
+                'duplicate_lines': [],
+                'failed': [],
+                })
+        self.assertEqual([p.name for p in [party1, party2, party3]],
+            ['Foo', 'Foo', 'Jack'])
+
+        result = massedit.execute_csv([
+                'id,name',
+                '%s,John' % party1.id,
+                '',
+                '%s,Julia' % party1.id,
+                '%s,Jane' % party2.id,
+                '%s,Jill' % party1.id,
+                ])
+        self.assertEqual(result['processed'], 4)
+        self.assertEqual(result['written'], 2)
+        self.assertEqual(result['duplicates'], 2)
+        self.assertEqual(result['duplicate_lines'], [4, 6])
+        self.assertEqual([p.name for p in [party1, party2]], ['John', 'Jane'])
+
+        result = massedit.execute_csv([
+                'name;code',
+                'Bar;P2',
+                'Baz;P4',
+                ], key='code', delimiter=';')
+        self.assertEqual(result['written'], 1)
+        self.assertEqual(result['unmatched_keys'], ['P4'])
+        self.assertEqual(party2.name, 'Bar')
+
+        for lines, key in [
+                (['name,code', 'Foo,P1'], 'id'),
+                (['id,categories', '1,2'], 'id'),
+                (['id,code', '1,P5'], 'id'),
+                (['id,name', 'x,Foo'], 'id'),
+                ]:
+            with self.assertRaises(UserError):
+                massedit.execute_csv(lines, key=key)
+
 del ModuleTestCase
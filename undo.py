@@ -0,0 +1,217 @@
+# The COPYRIGHT file at the top level of this repository contains the full
+# copyright notices and license terms.
+import json
+
+from trytond import backend
+from trytond.transaction import Transaction, without_check_access
+from trytond.pool import Pool
+from trytond.model import ModelView, ModelSQL, fields
+from trytond.pyson import Eval
+from trytond.protocols.jsonrpc import JSONDecoder, JSONEncoder
+from trytond.tools import grouped_slice
+
+
+def dumps(value):
+    return json.dumps(value, cls=JSONEncoder, separators=(',', ':'),
+        sort_keys=True)
+
+
+def loads(value):
+    return json.loads(value, object_hook=JSONDecoder())
+
+
+class MassEditUndo(ModelSQL, ModelView):
+    'Mass Edit Undo'
+    __name__ = 'mass.editing.undo'
+    mass_edit = fields.Many2One('mass.editing', 'Mass Edit', required=True,
+        readonly=True, ondelete='CASCADE')
+    job = fields.Many2One('mass.editing.job', 'Job', readonly=True,
+        ondelete='SET NULL')
+    state = fields.Selection([
+            ('done', 'Done'),
+            ('undone', 'Undone'),
+            ], 'State', readonly=True, required=True)
+    records = fields.Integer('Records', readonly=True)
+    irreversible = fields.Boolean('Irreversible', readonly=True,
+        help='Some related records were deleted by the edit and they are not '
+        'restored.')
+    lines = fields.One2Many('mass.editing.undo.line', 'undo', 'Lines',
+        readonly=True)
+
+    @classmethod
+    def __setup__(cls):
+        super(MassEditUndo, cls).__setup__()
+        cls._order.insert(0, ('create_date', 'DESC'))
+        cls._order.insert(1, ('id', 'DESC'))
+        cls._buttons.update({
+                'undo': {
+                    'invisible': Eval('state') != 'done',
+                    'depends': ['state'],
+                    },
+                })
+
+    @staticmethod
+    def default_state():
+        return 'done'
+
+    @staticmethod
+    def default_records():
+        return 0
+
+    @staticmethod
+    def default_irreversible():
+        return False
+
+    def get_rec_name(self, name):
+        return '%s (%s)' % (self.mass_edit.rec_name, self.id)
+
+    @classmethod
+    @without_check_access
+    def capture(cls, edit, EditingModel, ids, values, plan, undo=None,
+            job=None):
+        '''
+        Store the current values of the fields edited by values for the
+        records of ids and return the undo, which is created if None.
+
+        The records sharing the same value are grouped on a single line and
+        the xxx2many fields are stored as sets of ids.
+        '''
+        pool = Pool()
+        MassEdit = pool.get('mass.editing')
+        Line = pool.get('mass.editing.undo.line')
+
+        irreversible = False
+        lines = []
+        for key, operation in values.items():
+            if not key.startswith('selection_') or not operation:
+                continue
+            name = key.split('_', 1)[1]
+            field = plan[name]
+            groups = {}
+            if field.xxx2many:
+                if field.one2many and operation == 'remove_all':
+                    irreversible = True
+                    continue
+                related = MassEdit._get_xxx2many_map(EditingModel, name, ids)
+                for record_id, target_ids in related.items():
+                    groups.setdefault(dumps(sorted(target_ids)), []).append(
+                        record_id)
+            else:
+                for sub_ids in grouped_slice(ids, backend.MAX_QUERY_PARAMS):
+                    for record in EditingModel.read(list(sub_ids), [name]):
+                        value = record[name]
+                        if field.dict and value is not None:
+                            value = dict(value)
+                        groups.setdefault(dumps(value), []).append(
+                            record['id'])
+            for value, record_ids in groups.items():
+                lines.append({
+                        'field': name,
+                        'kind': 'xxx2many' if field.xxx2many else 'value',
+                        'value': value,
+                        'record_ids': dumps(sorted(record_ids)),
+                        'records': len(record_ids),
+                        })
+        if not lines:
+            return undo
+
+        if undo is None:
+            undo = cls(mass_edit=edit, job=job, records=0,
+                irreversible=False)
+        undo.records += len(ids)
+        undo.irreversible = undo.irreversible or irreversible
+        undo.save()
+        for line in lines:
+            line['undo'] = undo.id
+        Line.create(lines)
+        return undo
+
+    @classmethod
+    @ModelView.button
+    def undo(cls, undos):
+        "Restore the values stored by chunks of records"
+        pool = Pool()
+        MassEdit = pool.get('mass.editing')
+        for undo in undos:
+            if undo.state != 'done':
+                continue
+            EditingModel = pool.get(undo.mass_edit.model.name)
+            count = (undo.mass_edit.chunk_size
+                or MassEdit.default_chunk_size())
+            for line in undo.lines:
+                line.restore(EditingModel, count)
+        cls.write(undos, {'state': 'undone'})
+
+
+class MassEditUndoLine(ModelSQL, ModelView):
+    'Mass Edit Undo Line'
+    __name__ = 'mass.editing.undo.line'
+    undo = fields.Many2One('mass.editing.undo', 'Undo', required=True,
+        readonly=True, ondelete='CASCADE')
+    field = fields.Char('Field', required=True, readonly=True)
+    kind = fields.Selection([
+            ('value', 'Value'),
+            ('xxx2many', 'Related Records'),
+            ], 'Kind', required=True, readonly=True)
+    value = fields.Text('Value', readonly=True)
+    record_ids = fields.Text('Records', readonly=True)
+    records = fields.Integer('Number of Records', readonly=True)
+
+    def restore(self, EditingModel, count):
+        '''
+        Write back the value on the records by chunks of count.
+
+        The one2many lines created by the edit are deleted and the others are
+        removed.
+        '''
+        pool = Pool()
+        MassEdit = pool.get('mass.editing')
+        field = EditingModel._fields[self.field]
+        field = getattr(field, '_field', field)
+        value = loads(self.value)
+        for sub_ids in grouped_slice(loads(self.record_ids), count):
+            sub_ids = list(sub_ids)
+            if self.kind == 'value':
+                EditingModel.write(EditingModel.browse(sub_ids), {
+                        self.field: value,
+                        })
+                continue
+            value = set(value)
+            groups = {}
+            related = MassEdit._get_xxx2many_map(
+                EditingModel, self.field, sub_ids)
+            for record_id, target_ids in related.items():
+                groups.setdefault(frozenset(target_ids), []).append(
+                    record_id)
+            created = set()
+            if isinstance(field, fields.One2Many):
+                created = self._get_created(field.get_target(),
+                    set().union(*related.values()) - value)
+            to_write = []
+            for target_ids, record_ids in groups.items():
+                actions = []
+                extra = target_ids - value
+                if extra - created:
+                    actions.append(('remove', list(extra - created)))
+                if extra & created:
+                    actions.append(('delete', list(extra & created)))
+                if value - target_ids:
+                    actions.append(('add', list(value - target_ids)))
+                if actions:
+                    to_write.extend([
+                            EditingModel.browse(record_ids),
+                            {self.field: actions},
+                            ])
+            if to_write:
+                EditingModel.write(*to_write)
+
+    def _get_created(self, Target, ids):
+        "Return the ids of the records of Target created since the edit"
+        created = set()
+        with Transaction().set_context(active_test=False):
+            for sub_ids in grouped_slice(ids, backend.MAX_QUERY_PARAMS):
+                created.update(map(int, Target.search([
+                                ('id', 'in', list(sub_ids)),
+                                ('create_date', '>=', self.undo.create_date),
+                                ])))
+        return created
@@ -0,0 +1,129 @@
+# The COPYRIGHT file at the top level of this repository contains the full
+# copyright notices and license terms.
+import json
+import threading
+from contextlib import contextmanager
+
+from trytond.exceptions import UserError
+from trytond.i18n import gettext
+from trytond.model.exceptions import ValidationError
+from trytond.model import fields
+from trytond.pool import Pool, PoolMeta
+from trytond.tools import grouped_slice
+from trytond.transaction import Transaction, record_cache_size
+
+from .compute import Deferred
+
+_local = threading.local()
+# The maximum number of invalid records reported
+VALIDATION_ERRORS = 20
+
+
+@contextmanager
+def deferred_validation(Model, field_names):
+    '''
+    Collect the records of Model written in the block instead of validating
+    them after each write and, unless field_names is None, evaluate only the
+    write triggers of Model depending on field_names.
+    '''
+    previous = getattr(_local, 'deferred', None)
+    _local.deferred = deferred = Deferred(Model)
+    deferred.edited = set(field_names) if field_names is not None else None
+    try:
+        yield deferred
+    finally:
+        _local.deferred = previous
+
+
+def validate_deferred(Model, deferred):
+    '''
+    Validate the records collected by deferred by slices.
+
+    When a slice is not valid, its records are validated one by one to
+    report the id of each invalid record.
+    '''
+    field_names = deferred.field_names
+    for sub_ids in grouped_slice(
+            sorted(deferred.ids), record_cache_size(Transaction())):
+        records = Model.browse(sub_ids)
+        try:
+            Model._validate(records, field_names=field_names)
+        except UserError:
+            errors = []
+            for record in records:
+                try:
+                    Model._validate([record], field_names=field_names)
+                except UserError as exception:
+                    errors.append('%s: %s' % (record.id, exception.message))
+                    if len(errors) >= VALIDATION_ERRORS:
+                        break
+            if not errors:
+                raise
+            raise ValidationError(gettext(
+                    'mass_editing.msg_validation_records',
+                    model=Model.__name__, errors='\n'.join(errors)))
+
+
+def _condition_fields(condition):
+    '''
+    Return the fields of the record used by the encoded PYSON condition or
+    None if it uses other values.
+    '''
+    names = set()
+
+    def walk(value):
+        if isinstance(value, dict):
+            if value.get('__class__') == 'Eval':
+                path = value.get('v')
+                if not isinstance(path, str) or not path.startswith('self.'):
+                    return False
+                names.add(path.split('.')[1])
+            return all(walk(v) for v in value.values())
+        elif isinstance(value, list):
+            return all(walk(v) for v in value)
+        return True
+
+    try:
+        if walk(json.loads(condition)):
+            return names
+    except ValueError:
+        pass
+
+
+class ValidateMixin(object):
+    __slots__ = ()
+
+    @classmethod
+    def _validate(cls, records, field_names=None):
+        deferred = getattr(_local, 'deferred', None)
+        if deferred is not None and deferred.model == cls.__name__:
+            deferred.add(records, field_names)
+        else:
+            super()._validate(records, field_names=field_names)
+
+
+class Trigger(metaclass=PoolMeta):
+    __name__ = 'ir.trigger'
+
+    @classmethod
+    def get_triggers(cls, model_name, mode):
+        triggers = super(Trigger, cls).get_triggers(model_name, mode)
+        deferred = getattr(_local, 'deferred', None)
+        if (mode == 'write' and deferred is not None
+                and deferred.model == model_name
+                and deferred.edited is not None):
+            # The condition of the other triggers does not change
+            triggers = [t for t in triggers if t.depends_on(deferred.edited)]
+        return triggers
+
+    def depends_on(self, field_names):
+        "Return if the condition may change when field_names are written"
+        Model = Pool().get(self.model.name)
+        names = _condition_fields(self.condition)
+        if names is None:
+            return True
+        for name in names:
+            field = Model._fields.get(name)
+            if field is None or isinstance(field, fields.Function):
+                return True
+        return bool(names & set(field_names))